@@ -0,0 +1,164 @@
+import gzip
+import mmap
+import os
+import shutil
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Optional, Tuple
+
+# --- Constants ---
+# Default location of the precomputed tile archive
+ARCHIVE_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "mexico_city.tiles")
+# Archive layout (little-endian):
+#   header: magic (4s), version (H), min zoom (B), max zoom (B), tile count (Q),
+#           data version of the database the tiles were rendered from (32s, NUL-padded)
+#   index:  count sorted tile keys (Q), count data offsets (Q), count lengths (I)
+#   data:   concatenated gzip-compressed MVT tiles
+ARCHIVE_MAGIC = b"MCTA"
+ARCHIVE_VERSION = 3
+# Tiles are compressed once at build time so serving them never recompresses
+ARCHIVE_COMPRESSION_LEVEL = 9
+_HEADER = struct.Struct("<4sHBBQ32s")
+_MAGIC_VERSION = struct.Struct("<4sH")
+# Bits reserved for x and y in a tile key; enough for zoom 24
+_COORD_BITS = 24
+
+def tile_key(z: int, x: int, y: int) -> int:
+    """
+    Packs z/x/y into one integer that sorts by zoom, then x, then y.
+    Raises ValueError if x or y is outside the 2**z tiles of the zoom level.
+    """
+    if not (0 <= x < 1 << z and 0 <= y < 1 << z):
+        raise ValueError(f"Tile {z}/{x}/{y} is outside the zoom level.")
+    return (z << (2 * _COORD_BITS)) | (x << _COORD_BITS) | y
+
+class TileArchive:
+    """
+    Read-only, memory-mapped tile archive.
+
+    The index is loaded once into three flat arrays; lookups are a binary
+    search over the sorted keys and return a memoryview into the mapped data
+    file, so serving a tile does not copy it or touch the database.
+    """
+
+    def __init__(self, path: str = ARCHIVE_PATH):
+        """Maps the archive at `path`. Raises ValueError if it is empty, truncated or of another format."""
+        self.path = path
+        with open(path, "rb") as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError(f"Tile archive {path} is empty.")
+        try:
+            count = self._read_header()
+        except Exception:
+            self._mmap.close()
+            raise
+
+        offset = _HEADER.size
+        self._keys = _read_array("Q", self._mmap[offset:offset + 8 * count])
+        offset += 8 * count
+        self._offsets = _read_array("Q", self._mmap[offset:offset + 8 * count])
+        offset += 8 * count
+        self._lengths = _read_array("I", self._mmap[offset:offset + 4 * count])
+        self._data = memoryview(self._mmap)
+
+    def _read_header(self) -> int:
+        """Reads and checks the header and returns the tile count."""
+        # Magic and version come first in every format, so older archives are reported as such
+        if len(self._mmap) < _MAGIC_VERSION.size:
+            raise ValueError(f"Tile archive {self.path} is truncated: {len(self._mmap)} bytes is shorter than its header.")
+        magic, version = _MAGIC_VERSION.unpack_from(self._mmap, 0)
+        if magic != ARCHIVE_MAGIC or version != ARCHIVE_VERSION:
+            raise ValueError(f"Unsupported tile archive {self.path} (magic={magic!r}, version={version}).")
+        if len(self._mmap) < _HEADER.size:
+            raise ValueError(f"Tile archive {self.path} is truncated: {len(self._mmap)} bytes is shorter than its header.")
+        _, _, self.min_zoom, self.max_zoom, count, data_version = _HEADER.unpack_from(self._mmap, 0)
+        if len(self._mmap) < _HEADER.size + 20 * count:
+            raise ValueError(f"Tile archive {self.path} is truncated: its index of {count} tiles does not fit.")
+        self.data_version = data_version.rstrip(b"\0").decode("ascii")
+        return count
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def covers(self, z: int) -> bool:
+        """Returns True if the archive was built for zoom level z."""
+        return self.min_zoom <= z <= self.max_zoom
+
+    def get(self, z: int, x: int, y: int) -> Optional[memoryview]:
+        """Returns the gzip-compressed tile as a zero-copy view, or None if the tile is empty."""
+        if not (0 <= x < 1 << z and 0 <= y < 1 << z):
+            # Would pack to the key of another zoom's tile
+            return None
+        key = tile_key(z, x, y)
+        i = bisect_left(self._keys, key)
+        if i == len(self._keys) or self._keys[i] != key:
+            return None
+        start = self._offsets[i]
+        return self._data[start:start + self._lengths[i]]
+
+    def close(self):
+        self._data.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # A response still holds a view; the mapping is freed once it is released
+            pass
+
+def write_archive(path: str, tiles: Iterable[Tuple[int, int, int, bytes]], min_zoom: int, max_zoom: int,
+                  data_version: str = "") -> int:
+    """
+    Writes (z, x, y, data) tiles to an archive at `path`, gzip-compressed, and
+    returns the number of tiles written. Empty tiles are skipped; readers treat
+    missing keys as empty.
+    `data_version` records which database the tiles were rendered from.
+    The archive is written to a temporary file and renamed into place.
+    """
+    keys, lengths = array("Q"), array("I")
+    tmp_path = f"{path}.tmp"
+    data_path = f"{path}.data.tmp"
+    with open(data_path, "wb") as data_file:
+        entries = []
+        position = 0
+        for z, x, y, data in tiles:
+            if not data:
+                continue
+            data = gzip.compress(data, compresslevel=ARCHIVE_COMPRESSION_LEVEL, mtime=0)
+            data_file.write(data)
+            entries.append((tile_key(z, x, y), position, len(data)))
+            position += len(data)
+
+    entries.sort()
+    offsets = array("Q")
+    for key, position, length in entries:
+        keys.append(key)
+        offsets.append(position)
+        lengths.append(length)
+    data_start = _HEADER.size + 20 * len(entries)
+
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, min_zoom, max_zoom, len(entries), data_version.encode("ascii")))
+        f.write(_array_bytes(keys))
+        f.write(_array_bytes(array("Q", (offset + data_start for offset in offsets))))
+        f.write(_array_bytes(lengths))
+        with open(data_path, "rb") as data_file:
+            shutil.copyfileobj(data_file, f, 1 << 20)
+    os.remove(data_path)
+    os.replace(tmp_path, path)
+    return len(entries)
+
+def _read_array(typecode: str, buffer) -> array:
+    values = array(typecode)
+    values.frombytes(buffer)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+def _array_bytes(values: array) -> bytes:
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
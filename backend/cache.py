@@ -0,0 +1,340 @@
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - zstandard is listed in requirements.txt
+    zstandard = None
+
+# --- Constants ---
+# Bytes charged per entry on top of the payload (key, bookkeeping, empty tiles)
+ENTRY_OVERHEAD = 64
+# zstd level for the warm tier; low levels keep demotion cheap
+WARM_COMPRESSION_LEVEL = 3
+# Number of hash rows in the frequency sketch
+SKETCH_DEPTH = 4
+# The shared cache checks its size against the budget every this many writes
+SHARED_PRUNE_INTERVAL = 256
+# Pruning removes the oldest tiles until the shared cache is this full
+SHARED_PRUNE_TARGET = 0.9
+
+class FrequencySketch:
+    """
+    Count-min sketch of recent access frequency (the "TinyLFU" filter).
+    Counters saturate at 15 and are halved every `sample_size` increments so
+    that old popularity fades out.
+    """
+
+    def __init__(self, width: int = 1 << 16, sample_size: Optional[int] = None):
+        # Round the width up to a power of two so a mask can replace the modulo
+        self._width = 1 << max(width - 1, 1).bit_length()
+        self._mask = self._width - 1
+        self._rows = [bytearray(self._width) for _ in range(SKETCH_DEPTH)]
+        self._sample_size = sample_size or 10 * self._width
+        self._additions = 0
+
+    def _indexes(self, key: Hashable):
+        for row in range(SKETCH_DEPTH):
+            yield row, hash((row, key)) & self._mask
+
+    def increment(self, key: Hashable):
+        for row, i in self._indexes(key):
+            if self._rows[row][i] < 15:
+                self._rows[row][i] += 1
+        self._additions += 1
+        if self._additions >= self._sample_size:
+            self._age()
+
+    def estimate(self, key: Hashable) -> int:
+        return min(self._rows[row][i] for row, i in self._indexes(key))
+
+    def _age(self):
+        for row in self._rows:
+            row[:] = bytes(count >> 1 for count in row)
+        self._additions //= 2
+
+class _Tier:
+    """One byte-budgeted LRU segment of the cache."""
+
+    def __init__(self, name: str, budget_bytes: int):
+        self.name = name
+        self.budget_bytes = budget_bytes
+        # key -> (stored bytes or None, metadata string or None)
+        self.entries: "OrderedDict[Hashable, Tuple[Optional[bytes], Optional[str]]]" = OrderedDict()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def charge(stored: Optional[bytes], meta: Optional[str] = None) -> int:
+        return ENTRY_OVERHEAD + (len(stored) if stored else 0) + (len(meta) if meta else 0)
+
+    def insert(self, key: Hashable, stored: Optional[bytes], meta: Optional[str]):
+        self.entries[key] = (stored, meta)
+        self.size_bytes += self.charge(stored, meta)
+
+    def remove(self, key: Hashable) -> Tuple[Optional[bytes], Optional[str]]:
+        stored, meta = self.entries.pop(key)
+        self.size_bytes -= self.charge(stored, meta)
+        return stored, meta
+
+    def stats(self) -> Dict[str, object]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "size_bytes": self.size_bytes,
+            "budget_bytes": self.budget_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+class TileCache:
+    """
+    Byte-budgeted two-tier tile cache.
+
+    The hot tier keeps uncompressed tiles; the larger warm tier keeps
+    compressed tiles (zstd, zlib if zstandard is unavailable). Both tiers evict
+    in LRU order but only admit a new entry over the LRU victim if the
+    frequency sketch says it is requested more often (TinyLFU admission).
+    Entries evicted from the hot tier are demoted to the warm tier; warm hits
+    are promoted back to the hot tier.
+    `None` is a valid cached value (an empty tile). Each entry may carry a
+    short metadata string that is returned with it.
+    """
+
+    def __init__(self, hot_bytes: int, warm_bytes: int):
+        self._hot = _Tier("hot", hot_bytes)
+        self._warm = _Tier("warm", warm_bytes)
+        self._sketch = FrequencySketch()
+        self._lock = threading.Lock()
+        self._compress, self._decompress = _codec()
+
+    def get(self, key: Hashable) -> Tuple[bool, Optional[bytes]]:
+        """Returns (True, value) on a hit and (False, None) on a miss."""
+        hit, value, _ = self.get_entry(key)
+        return hit, value
+
+    def get_entry(self, key: Hashable) -> Tuple[bool, Optional[bytes], Optional[str]]:
+        """Returns (True, value, meta) on a hit and (False, None, None) on a miss."""
+        with self._lock:
+            self._sketch.increment(key)
+            if key in self._hot.entries:
+                self._hot.hits += 1
+                self._hot.entries.move_to_end(key)
+                value, meta = self._hot.entries[key]
+                return True, value, meta
+            self._hot.misses += 1
+
+            if key not in self._warm.entries:
+                self._warm.misses += 1
+                return False, None, None
+            self._warm.hits += 1
+            stored, meta = self._warm.remove(key)
+            value = self._decompress(stored) if stored else None
+            if not self._admit_hot(key, value, meta):
+                # Not hot enough for promotion; keep it warm as most recently used
+                self._warm.insert(key, stored, meta)
+            return True, value, meta
+
+    def put(self, key: Hashable, value: Optional[bytes], meta: Optional[str] = None):
+        """Stores a tile, subject to admission into the hot or warm tier."""
+        with self._lock:
+            if key in self._hot.entries or key in self._warm.entries:
+                return
+            if not self._admit_hot(key, value, meta):
+                self._admit_warm(key, value, meta)
+
+    def contains(self, key: Hashable) -> bool:
+        """Checks for a cached tile without counting an access."""
+        with self._lock:
+            return key in self._hot.entries or key in self._warm.entries
+
+    def clear(self):
+        """
+        Drops every tile and forgets their access counts, so tiles of new data
+        do not have to outrun the popularity of the keys they replace.
+        """
+        with self._lock:
+            self._hot.entries.clear()
+            self._hot.size_bytes = 0
+            self._warm.entries.clear()
+            self._warm.size_bytes = 0
+            self._sketch = FrequencySketch()
+
+    def stats(self) -> Dict[str, object]:
+        """Returns per-tier size, hit and miss counters and hit ratios."""
+        with self._lock:
+            return {tier.name: tier.stats() for tier in (self._hot, self._warm)}
+
+    def _admit_hot(self, key: Hashable, value: Optional[bytes], meta: Optional[str]) -> bool:
+        """
+        Inserts an uncompressed value into the hot tier if it fits or wins
+        against the LRU victims it would displace. Victims are demoted.
+        """
+        victims = self._victims(self._hot, key, _Tier.charge(value, meta))
+        if victims is None:
+            return False
+        for victim in victims:
+            self._admit_warm(victim, *self._hot.remove(victim))
+        self._hot.insert(key, value, meta)
+        return True
+
+    def _admit_warm(self, key: Hashable, value: Optional[bytes], meta: Optional[str]):
+        stored = self._compress(value) if value else None
+        victims = self._victims(self._warm, key, _Tier.charge(stored, meta))
+        if victims is None:
+            return
+        for victim in victims:
+            self._warm.remove(victim)
+        self._warm.insert(key, stored, meta)
+
+    def _victims(self, tier: _Tier, key: Hashable, charge: int):
+        """
+        Returns the LRU entries that must leave `tier` to make room for `key`,
+        or None if the candidate is too large or less frequent than a victim.
+        """
+        if charge > tier.budget_bytes:
+            return None
+        needed = tier.size_bytes + charge - tier.budget_bytes
+        if needed <= 0:
+            return []
+        candidate_frequency = self._sketch.estimate(key)
+        victims = []
+        for victim, (stored, meta) in tier.entries.items():
+            if self._sketch.estimate(victim) >= candidate_frequency:
+                return None
+            victims.append(victim)
+            needed -= _Tier.charge(stored, meta)
+            if needed <= 0:
+                return victims
+        return None
+
+class SharedTileCache:
+    """
+    Tile cache shared by all worker processes on a host, stored in a SQLite
+    database in WAL mode (readers never block each other; one writer at a time).
+    Tiles are stored compressed. When the total size exceeds the byte budget,
+    the oldest tiles are deleted. Keys must include the data version so that
+    workers serving different data never see each other's tiles.
+    """
+
+    def __init__(self, path: str, budget_bytes: int):
+        self.path = path
+        self.budget_bytes = budget_bytes
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._writes = 0
+        self._connection().execute(
+            """
+            CREATE TABLE IF NOT EXISTS tiles (
+                key TEXT PRIMARY KEY,
+                data BLOB,
+                meta TEXT,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL
+            )
+            """
+        )
+        self._connection().execute("CREATE INDEX IF NOT EXISTS idx_tiles_created ON tiles (created)")
+
+    def _connection(self) -> sqlite3.Connection:
+        """Returns this thread's SQLite connection and codec, opening them on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.compress, self._local.decompress = _codec()
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def get_entry(self, key: str) -> Tuple[bool, Optional[bytes], Optional[str]]:
+        """Returns (True, value, meta) on a hit and (False, None, None) on a miss."""
+        row = self._connection().execute("SELECT data, meta FROM tiles WHERE key = ?", (key,)).fetchone()
+        with self._lock:
+            if row is None:
+                self._misses += 1
+                return False, None, None
+            self._hits += 1
+        stored, meta = row
+        return True, (self._local.decompress(stored) if stored else None), meta
+
+    def put(self, key: str, value: Optional[bytes], meta: Optional[str] = None):
+        """Stores a tile unless another worker already did."""
+        conn = self._connection()
+        stored = self._local.compress(value) if value else None
+        size = ENTRY_OVERHEAD + (len(stored) if stored else 0) + (len(meta) if meta else 0)
+        try:
+            conn.execute(
+                "INSERT OR IGNORE INTO tiles (key, data, meta, size, created) VALUES (?, ?, ?, ?, ?)",
+                (key, stored, meta, size, time.time()),
+            )
+        except sqlite3.OperationalError as e:
+            # Another worker held the write lock for too long; the tile is simply not shared
+            print(f"Could not write tile {key} to the shared cache: {e}")
+            return
+        with self._lock:
+            self._writes += 1
+            should_prune = self._writes % SHARED_PRUNE_INTERVAL == 0
+        if should_prune:
+            self.prune()
+
+    def prune(self):
+        """Deletes the oldest tiles until the cache is back under its byte budget."""
+        conn = self._connection()
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM tiles").fetchone()[0]
+        if total <= self.budget_bytes:
+            return
+        conn.execute(
+            """
+            DELETE FROM tiles WHERE created <= (
+                SELECT created FROM (
+                    SELECT created, SUM(size) OVER (ORDER BY created DESC) AS newer_bytes FROM tiles
+                )
+                WHERE newer_bytes > ?
+                ORDER BY created DESC
+                LIMIT 1
+            )
+            """,
+            (int(self.budget_bytes * SHARED_PRUNE_TARGET),),
+        )
+
+    def stats(self) -> Dict[str, object]:
+        """Returns this worker's hit counters and the shared cache's size."""
+        entries, size = self._connection().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM tiles").fetchone()
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": entries,
+                "size_bytes": size,
+                "budget_bytes": self.budget_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": self._hits / lookups if lookups else 0.0,
+            }
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+def _codec() -> Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]:
+    """Returns the (compress, decompress) pair used by the warm tier."""
+    if zstandard is None:
+        return (lambda data: zlib.compress(data, WARM_COMPRESSION_LEVEL)), zlib.decompress
+    compressor = zstandard.ZstdCompressor(level=WARM_COMPRESSION_LEVEL)
+    decompressor = zstandard.ZstdDecompressor()
+    # zstandard contexts are not thread-safe; the cache lock serializes their use
+    return compressor.compress, decompressor.decompress
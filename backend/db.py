@@ -1,7 +1,9 @@
 import duckdb
 import os
 import queue
+import threading
 from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
 
 # --- Constants ---
 # Use a file-backed database so multiple connections share the same data
@@ -9,17 +11,54 @@ DB_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "mexico_city.duc
 GEOPARQUET_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "mexico_city.cleaned.3857.geoparquet")
 TABLE_NAME = "mexico_city"
 POOL_SIZE = 4
+# Seconds a request waits for a free pooled connection before failing
+POOL_TIMEOUT_S = 30
+# Background work (prefetching, profiled re-runs) only borrows a pooled connection
+# when at least this many are idle, so live requests always find a free one first
+BACKGROUND_MIN_IDLE = 2
+# Columns served in tiles and exports; ingestion drops every other column
+SERVED_COLUMNS = ("gid", "clave", "uso_suelo", "alcaldia", "no_niveles", "geometry")
+# Low-cardinality string columns stored as ENUM (dictionary) types
+CATEGORICAL_COLUMNS = ("uso_suelo", "alcaldia")
+# Zoom level of the grid the parcels are pre-cut along; tiles at this zoom and
+# deeper are rendered from the pieces of their ancestor tile at this zoom
+PRETILE_ZOOM = 14
+PRETILED_TABLE = f"{TABLE_NAME}_z{PRETILE_ZOOM}"
+# Width of the margin kept around each pre-tiled cell, as a fraction of the cell;
+# matches the MVT buffer (256 / 4096) so clipping at the buffer edge is unchanged
+PRETILE_MARGIN = 256 / 4096
+# Half the width of the Web Mercator (EPSG:3857) world in meters
+WEB_MERCATOR_HALF_WORLD = 20037508.342789244
+# Number of server worker processes (as read by uvicorn and gunicorn)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# Open the database read-only. Required when several worker processes share the
+# file, so it defaults to on in multi-worker deployments. The table must already exist.
+DB_READ_ONLY = os.getenv("TILE_DB_READ_ONLY", "1" if WEB_CONCURRENCY > 1 else "0") == "1"
+# Build a missing pre-tiled table when the server starts on a writable database.
+# Off by default, since it cuts every parcel in the city; `python -m backend.db` always builds it
+PRETILE_ON_STARTUP = os.getenv("TILE_PRETILE_ON_STARTUP", "0") == "1"
 
 # --- Database Connection ---
 # A global connection pool initialized at startup
 _pool: queue.Queue = None
+# Fingerprint of the database file the pool was opened on
+_data_version: Optional[str] = None
+# Open connections owned by the pool, idle or borrowed (0 after a failed reload)
+_pool_connections = 0
+_reload_lock = threading.Lock()
+# Connections opened outside the pool for long reads (exports)
+_dedicated: Dict[duckdb.DuckDBPyConnection, "_DedicatedRead"] = {}
+_dedicated_lock = threading.Lock()
 
 def get_db_connection() -> duckdb.DuckDBPyConnection:
     """Borrows a DuckDB connection from the pool."""
     global _pool
     if _pool is None:
         raise RuntimeError("Database connection pool has not been initialized. Call init_db() at application startup.")
-    return _pool.get()
+    try:
+        return _pool.get(timeout=POOL_TIMEOUT_S)
+    except queue.Empty:
+        raise RuntimeError(f"No database connection became free within {POOL_TIMEOUT_S} seconds.")
 
 def release_db_connection(conn: duckdb.DuckDBPyConnection):
     """Returns a DuckDB connection to the pool."""
@@ -28,6 +67,12 @@ def release_db_connection(conn: duckdb.DuckDBPyConnection):
         raise RuntimeError("Database connection pool has not been initialized. Call init_db() at application startup.")
     _pool.put(conn)
 
+def idle_connections() -> int:
+    """Returns the number of pooled connections not currently borrowed."""
+    if _pool is None:
+        return 0
+    return _pool.qsize()
+
 @contextmanager
 def db_connection():
     """Context manager for a pooled DuckDB connection."""
@@ -37,6 +82,84 @@ def db_connection():
     finally:
         release_db_connection(conn)
 
+@contextmanager
+def dedicated_connection():
+    """
+    Context manager for a connection outside the pool, for long reads such as
+    exports that would otherwise keep a pooled connection away from tiles.
+    A reload of the database interrupts and closes it, so it never keeps the
+    replaced file open.
+    """
+    # Never open one mid-reload, where it would pin the file being replaced
+    with _reload_lock:
+        conn = _create_connection()
+        with _dedicated_lock:
+            _dedicated[conn] = _DedicatedRead()
+    try:
+        yield conn
+    finally:
+        with _dedicated_lock:
+            _dedicated.pop(conn, None)
+        conn.close()
+
+class _DedicatedRead:
+    """The Arrow reader streaming from a dedicated connection, if any."""
+
+    def __init__(self):
+        # Held while a batch is read, so a reload never closes the reader mid-read
+        self.lock = threading.Lock()
+        self.reader = None
+        self.closed = False
+
+def read_record_batches(db_con: duckdb.DuckDBPyConnection, query: str, params: List[object],
+                        batch_rows: int) -> Iterator[object]:
+    """
+    Runs `query` and yields its result as Arrow record batches of up to
+    `batch_rows` rows. An open reader keeps the database instance alive even
+    after its connection is closed, so on a dedicated connection the reader is
+    closed by a reload, and reading on raises instead of pinning the old file
+    while the consumer waits between batches.
+    """
+    with _dedicated_lock:
+        read = _dedicated.get(db_con)
+    if read is None:
+        yield from db_con.execute(query, params).to_arrow_reader(batch_rows)
+        return
+
+    with read.lock:
+        if read.closed:
+            raise RuntimeError("The connection was closed by a database reload.")
+        read.reader = db_con.execute(query, params).to_arrow_reader(batch_rows)
+    try:
+        while True:
+            with read.lock:
+                if read.closed:
+                    raise RuntimeError("The connection was closed by a database reload.")
+                try:
+                    batch = read.reader.read_next_batch()
+                except StopIteration:
+                    return
+            yield batch
+    finally:
+        with read.lock:
+            if read.reader is not None:
+                read.reader.close()
+                read.reader = None
+
+def _close_dedicated_connections():
+    with _dedicated_lock:
+        reads = list(_dedicated.items())
+        _dedicated.clear()
+    for conn, read in reads:
+        # Interrupting first cuts short a batch being read under the lock
+        conn.interrupt()
+        with read.lock:
+            read.closed = True
+            if read.reader is not None:
+                read.reader.close()
+                read.reader = None
+            conn.close()
+
 def _perform_sanity_checks(db_con: duckdb.DuckDBPyConnection):
     """
     Performs the startup sanity checks as described in GeneralSpecs.md.
@@ -81,48 +204,209 @@ def _perform_sanity_checks(db_con: duckdb.DuckDBPyConnection):
     print("--- All database sanity checks passed successfully! ---")
 
 
+def database_fingerprint() -> str:
+    """
+    Identifies the current contents of the database file by its mtime and size.
+    This is the data version served once the pool is open on the file.
+    """
+    stat = os.stat(DB_PATH)
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+def data_version() -> Optional[str]:
+    """Returns the fingerprint of the database the pool is serving, or None before init_db()."""
+    return _data_version
+
+def database_changed() -> bool:
+    """Returns True if the database file was replaced since the pool was opened."""
+    try:
+        return _data_version is not None and database_fingerprint() != _data_version
+    except FileNotFoundError:
+        # The file is being swapped; check again later
+        return False
+
+def _is_compact(db_con: duckdb.DuckDBPyConnection) -> bool:
+    """Returns True if the table already has the compact schema written by create_table()."""
+    column_types = dict(db_con.execute(
+        "SELECT column_name, data_type FROM information_schema.columns WHERE table_name = ?;", [TABLE_NAME]
+    ).fetchall())
+    return (
+        set(column_types) == set(SERVED_COLUMNS)
+        and column_types["no_niveles"] == "INTEGER"
+        and all(column_types[column].startswith("ENUM") for column in CATEGORICAL_COLUMNS)
+    )
+
+def table_exists(db_con: duckdb.DuckDBPyConnection, name: str) -> bool:
+    """Returns True if the database has a table called `name`."""
+    return db_con.execute("SELECT count(*) FROM information_schema.tables WHERE table_name = ?;", [name]).fetchone()[0] > 0
+
+def pretile_key(x: int, y: int) -> int:
+    """Returns the key of cell x/y (tile coordinates at PRETILE_ZOOM) in the pre-tiled table."""
+    return (x << PRETILE_ZOOM) | y
+
+def create_table(db_con: duckdb.DuckDBPyConnection, source: str):
+    """
+    (Re)builds the served table from `source` (a table name or a read_parquet(...)
+    call) with only the served columns, ENUM types for the categorical columns
+    and `no_niveles` normalized to a non-null INTEGER, then indexes and pre-tiles it.
+    Runs in one transaction, so a failure leaves the previous tables and types in place.
+    """
+    db_con.execute("BEGIN TRANSACTION;")
+    try:
+        _create_table(db_con, source)
+        db_con.execute("COMMIT;")
+    except Exception:
+        db_con.execute("ROLLBACK;")
+        raise
+
+def _create_table(db_con: duckdb.DuckDBPyConnection, source: str):
+    # The pre-tiled pieces use the ENUM types and are rebuilt below
+    db_con.execute(f"DROP TABLE IF EXISTS {PRETILED_TABLE};")
+    for column in CATEGORICAL_COLUMNS:
+        enum_type = f"{TABLE_NAME}_{column}"
+        db_con.execute(f"DROP TYPE IF EXISTS {enum_type};")
+        db_con.execute(f"""
+            CREATE TYPE {enum_type} AS ENUM (
+                SELECT DISTINCT CAST({column} AS VARCHAR) FROM {source} WHERE {column} IS NOT NULL ORDER BY 1
+            );
+        """)
+
+    # Build next to the current table so a migration can read from it
+    db_con.execute(f"""
+        CREATE OR REPLACE TABLE {TABLE_NAME}_compact AS
+        SELECT
+            gid,
+            clave,
+            CAST(uso_suelo AS {TABLE_NAME}_uso_suelo) AS uso_suelo,
+            CAST(alcaldia AS {TABLE_NAME}_alcaldia) AS alcaldia,
+            CAST(COALESCE(TRY_CAST(no_niveles AS INTEGER), 0) AS INTEGER) AS no_niveles,
+            geometry
+        FROM {source};
+    """)
+    db_con.execute(f"DROP TABLE IF EXISTS {TABLE_NAME};")
+    db_con.execute(f"ALTER TABLE {TABLE_NAME}_compact RENAME TO {TABLE_NAME};")
+
+    # Create spatial index
+    print("Creating spatial index...")
+    db_con.execute(f"CREATE INDEX IF NOT EXISTS idx_geometry ON {TABLE_NAME} USING RTREE (geometry);")
+
+    create_pretiled_table(db_con)
+
+def create_pretiled_table(db_con: duckdb.DuckDBPyConnection):
+    """
+    (Re)builds the pre-tiled table: every parcel cut along the PRETILE_ZOOM
+    tile grid, one piece per cell whose buffered envelope it touches, stored
+    with the cell key and sorted by it. Rendering a tile at PRETILE_ZOOM or
+    deeper then reads the row groups of a single key instead of probing the
+    RTREE and clipping whole parcels.
+    """
+    n = 2 ** PRETILE_ZOOM
+    span = 2 * WEB_MERCATOR_HALF_WORLD / n
+    margin = span * PRETILE_MARGIN
+    print(f"Cutting parcels along the z{PRETILE_ZOOM} grid into '{PRETILED_TABLE}'...")
+    db_con.execute(f"""
+        CREATE OR REPLACE TABLE {PRETILED_TABLE} AS
+        WITH
+        ranges AS (
+            -- 1. Range of cells whose buffered envelope overlaps the parcel's bounding box
+            SELECT
+                t.*,
+                ST_Area(t.geometry) AS area,
+                greatest(CAST(floor((ST_XMin(t.geometry) - {margin} + {WEB_MERCATOR_HALF_WORLD}) / {span}) AS INTEGER), 0) AS x0,
+                least(CAST(floor((ST_XMax(t.geometry) + {margin} + {WEB_MERCATOR_HALF_WORLD}) / {span}) AS INTEGER), {n - 1}) AS x1,
+                greatest(CAST(floor(({WEB_MERCATOR_HALF_WORLD} - ST_YMax(t.geometry) - {margin}) / {span}) AS INTEGER), 0) AS y0,
+                least(CAST(floor(({WEB_MERCATOR_HALF_WORLD} - ST_YMin(t.geometry) + {margin}) / {span}) AS INTEGER), {n - 1}) AS y1
+            FROM {TABLE_NAME} t
+        ),
+        columns AS (
+            SELECT *, UNNEST(range(x0, x1 + 1)) AS cell_x FROM ranges
+        ),
+        cells AS (
+            SELECT *, UNNEST(range(y0, y1 + 1)) AS cell_y FROM columns
+        ),
+        pieces AS (
+            -- 2. Clip against the buffered cell; parcels inside a single cell are kept whole.
+            --    Only the polygonal part is kept: a parcel touching the envelope along an
+            --    edge or corner would otherwise leave a line or point piece, and a parcel
+            --    repaired by make_valid may be a collection of a polygon and lines
+            SELECT
+                (cell_x << {PRETILE_ZOOM}) | cell_y AS tile_key,
+                gid,
+                clave,
+                uso_suelo,
+                alcaldia,
+                no_niveles,
+                area,
+                CASE
+                    WHEN x0 = x1 AND y0 = y1 THEN ST_CollectionExtract(geometry, 3)
+                    ELSE ST_CollectionExtract(ST_Intersection(geometry, ST_MakeEnvelope(
+                        {-WEB_MERCATOR_HALF_WORLD} + cell_x * {span} - {margin},
+                        {WEB_MERCATOR_HALF_WORLD} - (cell_y + 1) * {span} - {margin},
+                        {-WEB_MERCATOR_HALF_WORLD} + (cell_x + 1) * {span} + {margin},
+                        {WEB_MERCATOR_HALF_WORLD} - cell_y * {span} + {margin}
+                    )), 3)
+                END AS geometry
+            FROM cells
+        )
+        -- 3. Sorted by key so a lookup only touches the row groups of one cell
+        SELECT * FROM pieces
+        WHERE NOT ST_IsEmpty(geometry)
+          AND ST_GeometryType(geometry) IN ('POLYGON', 'MULTIPOLYGON')
+        ORDER BY tile_key;
+    """)
+    pieces = db_con.execute(f"SELECT COUNT(*) FROM {PRETILED_TABLE};").fetchone()[0]
+    print(f"Stored {pieces} pre-tiled pieces in '{PRETILED_TABLE}'.")
+
 def _create_connection() -> duckdb.DuckDBPyConnection:
     """
     Creates a DuckDB connection with spatial extension loaded.
     """
-    conn = duckdb.connect(database=DB_PATH, read_only=False)
+    conn = duckdb.connect(database=DB_PATH, read_only=DB_READ_ONLY)
     conn.execute("INSTALL spatial;")
     conn.execute("LOAD spatial;")
     return conn
 
-def init_db():
+def init_db(pretile: Optional[bool] = None):
     """
     Initializes the DuckDB connection, loads the spatial extension,
     creates the table from the GeoParquet file, and performs sanity checks.
     This function should be called once at application startup.
+    A missing pre-tiled table is only built if `pretile` (default
+    PRETILE_ON_STARTUP) is set; until then tiles are rendered from the parcels.
     """
-    global _pool
+    global _pool, _data_version, _pool_connections
 
-    print("Initializing database connection...")
+    print(f"Initializing database connection ({'read-only' if DB_READ_ONLY else 'read-write'})...")
     bootstrap_con = _create_connection()
 
     # Perform sanity checks *after* loading the extension
     _perform_sanity_checks(bootstrap_con)
 
     # Check if table already exists to avoid reloading data
-    table_exists = bootstrap_con.execute(f"SELECT count(*) FROM information_schema.tables WHERE table_name = '{TABLE_NAME}'").fetchone()[0] > 0
+    has_table = table_exists(bootstrap_con, TABLE_NAME)
 
-    if table_exists:
+    if has_table and _is_compact(bootstrap_con):
         print(f"Table '{TABLE_NAME}' already exists. Skipping data load.")
+        if not table_exists(bootstrap_con, PRETILED_TABLE):
+            if pretile is None:
+                pretile = PRETILE_ON_STARTUP
+            if DB_READ_ONLY or not pretile:
+                print(f"Table '{PRETILED_TABLE}' not found; tiles are rendered from '{TABLE_NAME}'. Run `python -m backend.db` to build it.")
+            else:
+                create_pretiled_table(bootstrap_con)
+    elif has_table and DB_READ_ONLY:
+        raise RuntimeError(f"Table '{TABLE_NAME}' in read-only database {DB_PATH} uses the old schema. Run `python -m backend.db` to migrate it.")
+    elif has_table:
+        print(f"Migrating table '{TABLE_NAME}' to the compact schema...")
+        create_table(bootstrap_con, TABLE_NAME)
+    elif DB_READ_ONLY:
+        raise RuntimeError(f"Table '{TABLE_NAME}' not found in read-only database {DB_PATH}. Build the database before starting workers.")
     else:
         # Load data from GeoParquet file
         print(f"Loading data from {GEOPARQUET_PATH} into table '{TABLE_NAME}'...")
         if not os.path.exists(GEOPARQUET_PATH):
             raise FileNotFoundError(f"GeoParquet file not found at: {GEOPARQUET_PATH}. Please run prepare_data.py first.")
         
-        bootstrap_con.execute(f"""
-            CREATE OR REPLACE TABLE {TABLE_NAME} AS
-            SELECT * FROM read_parquet('{GEOPARQUET_PATH}');
-        """)
-
-        # Create spatial index
-        print("Creating spatial index...")
-        bootstrap_con.execute(f"CREATE INDEX IF NOT EXISTS idx_geometry ON {TABLE_NAME} USING RTREE (geometry);")
+        create_table(bootstrap_con, f"read_parquet('{GEOPARQUET_PATH}')")
     
     # Verify data loading
     count = bootstrap_con.execute(f"SELECT COUNT(*) FROM {TABLE_NAME};").fetchone()[0]
@@ -133,17 +417,77 @@ def init_db():
 
     print(f"Creating connection pool with size {POOL_SIZE}...")
     _pool = queue.Queue(maxsize=POOL_SIZE)
-    for _ in range(POOL_SIZE):
-        conn = _create_connection()
-        _perform_sanity_checks(conn)
+    _data_version = database_fingerprint()
+    for conn in _open_connections():
         _pool.put(conn)
+    _pool_connections = POOL_SIZE
+
+def _open_connections() -> List[duckdb.DuckDBPyConnection]:
+    """Opens and checks POOL_SIZE connections; closes them all if any fails."""
+    connections = []
+    try:
+        for _ in range(POOL_SIZE):
+            conn = _create_connection()
+            connections.append(conn)
+            _perform_sanity_checks(conn)
+    except Exception:
+        for conn in connections:
+            conn.close()
+        raise
+    return connections
+
+def reload_db(on_closed: Optional[Callable[[], None]] = None):
+    """
+    Reopens every pooled connection so a replaced database file is served.
+    Cuts off dedicated connections and their readers, waits for borrowed
+    connections to come back, closes all of them (DuckDB keeps serving the
+    old file while any connection to it is open), runs `on_closed`, and
+    refills the same queue so waiting requests proceed.
+
+    The new connections are opened and checked before any is handed out, and
+    the data version only moves once they are in the pool. If opening fails
+    (for example, the file is caught mid-copy or changes while it is being
+    opened), the error is raised with the old version kept, so
+    database_changed() stays True and the next check retries. Until then,
+    requests fail after POOL_TIMEOUT_S instead of waiting forever.
+    """
+    global _data_version, _pool_connections
+    if _pool is None:
+        raise RuntimeError("Database connection pool has not been initialized. Call init_db() at application startup.")
+    with _reload_lock:
+        _close_dedicated_connections()
+        connections = [_pool.get() for _ in range(_pool_connections)]
+        for conn in connections:
+            conn.close()
+        _pool_connections = 0
+        if on_closed is not None:
+            on_closed()
+
+        version = database_fingerprint()
+        fresh = _open_connections()
+        if database_fingerprint() != version:
+            for conn in fresh:
+                conn.close()
+            raise RuntimeError(f"Database {DB_PATH} changed while it was being opened; retrying at the next check.")
+        for conn in fresh:
+            _pool.put(conn)
+        _pool_connections = len(fresh)
+        _data_version = version
+        print(f"Reloaded database {DB_PATH} (data version {_data_version}).")
 
 def close_db():
     """Closes the database connection. Should be called at application shutdown."""
-    global _pool
+    global _pool, _data_version, _pool_connections
     if _pool:
         print("Closing database connection pool...")
         while not _pool.empty():
             conn = _pool.get()
             conn.close()
         _pool = None
+    _pool_connections = 0
+    _data_version = None
+
+if __name__ == "__main__":
+    # Builds, migrates or pre-tiles the database file without starting the server
+    init_db(pretile=True)
+    close_db()
@@ -0,0 +1,139 @@
+import argparse
+import duckdb
+import json
+import math
+import sys
+from typing import Iterator, List, Optional, Tuple
+from .db import DB_PATH, TABLE_NAME, WEB_MERCATOR_HALF_WORLD, read_record_batches
+
+# --- Constants ---
+# Rows per Arrow record batch pulled from DuckDB; one batch is encoded per chunk
+EXPORT_BATCH_ROWS = 2048
+# Export formats and their media types:
+#   ndjson:  one GeoJSON Feature per line (GeoJSONSeq without record separators)
+#   geojson: a single FeatureCollection, streamed feature by feature
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "geojson": "application/geo+json",
+}
+# Latitude limit of the Web Mercator projection
+_MAX_LATITUDE = 85.05112878
+
+BBox = Tuple[float, float, float, float]
+
+def parse_bbox(text: str) -> BBox:
+    """
+    Parses "minlon,minlat,maxlon,maxlat" (EPSG:4326) into a tuple.
+    Raises ValueError if it is malformed or out of range.
+    """
+    try:
+        minlon, minlat, maxlon, maxlat = (float(part) for part in text.split(","))
+    except ValueError:
+        raise ValueError("bbox must have the form minlon,minlat,maxlon,maxlat.")
+    if not (-180 <= minlon <= maxlon <= 180 and -90 <= minlat <= maxlat <= 90):
+        raise ValueError("bbox must be ordered min before max, with longitudes within ±180 and latitudes within ±90.")
+    return minlon, minlat, maxlon, maxlat
+
+def lonlat_to_mercator(lon: float, lat: float) -> Tuple[float, float]:
+    """Projects a longitude/latitude pair to Web Mercator (EPSG:3857) meters."""
+    lat = max(-_MAX_LATITUDE, min(_MAX_LATITUDE, lat))
+    x = lon * WEB_MERCATOR_HALF_WORLD / 180
+    y = math.log(math.tan((90 + lat) * math.pi / 360)) * WEB_MERCATOR_HALF_WORLD / math.pi
+    return x, y
+
+def build_export_query(alcaldia: Optional[str] = None, bbox: Optional[BBox] = None) -> Tuple[str, List[object]]:
+    """
+    Builds the export query and its parameters. Geometries are returned as
+    GeoJSON text in EPSG:4326. The bbox envelope is inlined in Web Mercator
+    so the RTREE index is used; the rows are not sorted, so DuckDB can stream
+    them without materializing the result.
+    """
+    filters, params = [], []
+    if alcaldia is not None:
+        # Compared as text so an unknown name matches nothing instead of failing the ENUM cast
+        filters.append("CAST(t.alcaldia AS VARCHAR) = ?")
+        params.append(alcaldia)
+    if bbox is not None:
+        xmin, ymin = lonlat_to_mercator(bbox[0], bbox[1])
+        xmax, ymax = lonlat_to_mercator(bbox[2], bbox[3])
+        filters.append(f"ST_Intersects(t.geometry, ST_MakeEnvelope({xmin}, {ymin}, {xmax}, {ymax}))")
+    where = f"WHERE {' AND '.join(filters)}" if filters else ""
+    query = f"""
+        SELECT
+            t.gid,
+            t.clave,
+            CAST(t.uso_suelo AS VARCHAR) AS uso_suelo,
+            CAST(t.alcaldia AS VARCHAR) AS alcaldia,
+            t.no_niveles,
+            ST_AsGeoJSON(ST_Transform(t.geometry, 'EPSG:3857', 'EPSG:4326', true)) AS geometry
+        FROM {TABLE_NAME} t
+        {where};
+    """
+    return query, params
+
+def export_features(db_con: duckdb.DuckDBPyConnection, fmt: str = "ndjson", alcaldia: Optional[str] = None,
+                    bbox: Optional[BBox] = None, batch_rows: int = EXPORT_BATCH_ROWS) -> Iterator[bytes]:
+    """
+    Yields the export as encoded chunks, one per Arrow record batch read from
+    DuckDB. Nothing is read ahead of the consumer, so memory stays bounded by
+    one batch however large the export is, and a slow consumer slows the scan.
+    On a dedicated connection, a database reload ends the export with an error.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format '{fmt}'. Use one of: {', '.join(EXPORT_FORMATS)}.")
+    query, params = build_export_query(alcaldia, bbox)
+    batches = read_record_batches(db_con, query, params, batch_rows)
+
+    collection = fmt == "geojson"
+    separator = b",\n" if collection else b"\n"
+    if collection:
+        yield b'{"type": "FeatureCollection", "features": [\n'
+    first = True
+    for batch in batches:
+        columns = batch.to_pydict()
+        features = [
+            '{"type": "Feature", "id": %s, "properties": %s, "geometry": %s}' % (
+                json.dumps(gid),
+                json.dumps({"gid": gid, "clave": clave, "uso_suelo": uso_suelo, "alcaldia": alcaldia_name, "no_niveles": no_niveles}),
+                geometry or "null",
+            )
+            for gid, clave, uso_suelo, alcaldia_name, no_niveles, geometry in zip(
+                columns["gid"], columns["clave"], columns["uso_suelo"],
+                columns["alcaldia"], columns["no_niveles"], columns["geometry"],
+            )
+        ]
+        if not features:
+            continue
+        chunk = separator.join(feature.encode() for feature in features)
+        if collection:
+            # Features are comma-separated across batches too
+            chunk = chunk if first else separator + chunk
+        else:
+            chunk += separator
+        first = False
+        yield chunk
+    if collection:
+        yield b"\n]}\n"
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream parcels as line-delimited GeoJSON or a GeoJSON FeatureCollection.")
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="ndjson")
+    parser.add_argument("--alcaldia", help="Only export parcels of this alcaldía.")
+    parser.add_argument("--bbox", type=parse_bbox, help="minlon,minlat,maxlon,maxlat in EPSG:4326.")
+    parser.add_argument("--output", default="-", help="Output file, or - for stdout.")
+    args = parser.parse_args()
+
+    conn = duckdb.connect(database=DB_PATH, read_only=True)
+    conn.execute("INSTALL spatial;")
+    conn.execute("LOAD spatial;")
+    output = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        for chunk in export_features(conn, args.format, args.alcaldia, args.bbox):
+            output.write(chunk)
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+        conn.close()
+
+if __name__ == "__main__":
+    main()
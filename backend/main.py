@@ -1,22 +1,68 @@
-from fastapi import FastAPI, Response
+from fastapi import FastAPI, Header, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from starlette.middleware.gzip import GZipMiddleware # Import GZipMiddleware
-from functools import lru_cache
+import gzip
+import hmac
+import itertools
 import os
-from typing import Optional
-from .db import init_db, close_db, db_connection, TABLE_NAME
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from .archive import ARCHIVE_PATH, TileArchive
+from .cache import SharedTileCache, TileCache
+from .db import (
+    WEB_CONCURRENCY,
+    TABLE_NAME,
+    close_db,
+    data_version,
+    database_changed,
+    db_connection,
+    dedicated_connection,
+    init_db,
+    reload_db,
+)
+from .export import EXPORT_FORMATS, export_features, parse_bbox
+from .profiling import TileProfiler, duckdb_profiling
+from .tiles import (
+    RenderedTile,
+    encode_tile_batch,
+    fetch_tile,
+    fetch_tiles,
+    render_tile,
+    reset_connection_state,
+    tile_in_range,
+    tile_budget_stats,
+    tile_source,
+)
+from .warming import TileWarmer
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup event
     print("Starting up the application...")
     init_db()
+    open_shared_cache()
+    start_data_version_watch()
+    open_tile_archive()
+    if PREFETCH_ENABLED:
+        tile_warmer.start()
+    tile_profiler.start()
     yield
     # Shutdown event
     print("Shutting down the application...")
+    # Stop background prefetching before the pool goes away
+    tile_warmer.stop()
+    tile_profiler.stop()
+    stop_data_version_watch()
+    close_tile_archive()
+    close_shared_cache()
     close_db()
+    reset_connection_state()
 
 app = FastAPI(
     title="Mexico City Cadastral Map Tile Server",
@@ -27,96 +73,220 @@ app = FastAPI(
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
-    allow_methods=["GET"],
+    allow_methods=["GET", "POST"],
     allow_headers=["*"],
+    expose_headers=["X-Tile-Reduction"],
 )
 
 app.add_middleware(GZipMiddleware, minimum_size=1000) # Add GZipMiddleware
 
 # --- Constants ---
-# The name of the layer in the MVT tile
-LAYER_NAME = "cadastre_layer"
 # The minimum and maximum zoom levels this server will generate tiles for
 MIN_ZOOM = 14
 MAX_ZOOM = 18 # Matches frontend maxzoom
 # Cache version used to bust the in-process tile cache when schema changes
 CACHE_VERSION = os.getenv("TILE_CACHE_VERSION", "1")
+# Byte budgets of the uncompressed (hot) and compressed (warm) tile cache tiers
+TILE_CACHE_HOT_MB = int(os.getenv("TILE_CACHE_HOT_MB", "64"))
+TILE_CACHE_WARM_MB = int(os.getenv("TILE_CACHE_WARM_MB", "256"))
+# Cross-process tile cache shared by all workers on the host. Enabled by default
+# when running several workers; set to an empty string to disable.
+_default_shared_cache_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+SHARED_CACHE_PATH = os.getenv(
+    "TILE_SHARED_CACHE_PATH",
+    os.path.join(_default_shared_cache_dir, "gemini-mbtiles-tiles.sqlite") if WEB_CONCURRENCY > 1 else "",
+)
+SHARED_CACHE_MB = int(os.getenv("TILE_SHARED_CACHE_MB", "1024"))
+# Seconds between checks for a replaced database file (0 disables the check)
+DATA_VERSION_CHECK_S = float(os.getenv("TILE_DATA_VERSION_CHECK_S", "30"))
+# Precomputed tile archive; tiles at the zooms it covers bypass DuckDB
+TILE_ARCHIVE_PATH = os.getenv("TILE_ARCHIVE_PATH", ARCHIVE_PATH)
+# Set TILE_PREFETCH=0 to disable background prefetching and cache warming
+PREFETCH_ENABLED = os.getenv("TILE_PREFETCH", "1") == "1"
+# Token required by /admin endpoints; they are disabled while it is unset
+ADMIN_TOKEN = os.getenv("TILE_ADMIN_TOKEN")
+# Upper bound on the number of tiles a single batch request may ask for
+MAX_BATCH_TILES = 64
+# Media type of the length-prefixed batch container (see backend/tiles.py)
+BATCH_MEDIA_TYPE = "application/vnd.cadastre.tile-batch"
+# Number of exports streamed at once; each holds its own connection until it ends
+EXPORT_MAX_CONCURRENT = int(os.getenv("TILE_EXPORT_MAX_CONCURRENT", "1"))
 
-def get_simplification_tolerance(z: int):
+class ArchiveTileResponse(Response):
     """
-    Returns the simplification tolerance based on the zoom level.
+    Response whose body is a memoryview into the tile archive, sent without
+    copying. Archived tiles are already gzip-compressed, and the
+    Content-Encoding header makes GZipMiddleware pass them through untouched.
     """
-    # Earth circumference in meters (Web Mercator)
-    circumference = 40075016.68
-    tile_size = 256
-    
-    # Resolution in meters per pixel
-    resolution = circumference / (tile_size * (2 ** z))
-    
-    # Simplification tolerance: 0.5 pixel
-    return resolution * 0.5
+    media_type = "application/vnd.mapbox-vector-tile"
+
+    def render(self, content) -> memoryview:
+        return content
+
+class TileBatchRequest(BaseModel):
+    """Body of a batch tile request: a list of "z/x/y" tile keys."""
+    tiles: List[str]
+
+# The memory-mapped archive, if one was found for the data being served
+tile_archive: Optional[TileArchive] = None
+
+def open_tile_archive():
+    """Opens the precomputed tile archive if it exists and was built from the database being served."""
+    global tile_archive
+    if not os.path.exists(TILE_ARCHIVE_PATH):
+        return
+    try:
+        archive = TileArchive(TILE_ARCHIVE_PATH)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring tile archive {TILE_ARCHIVE_PATH}: {e}")
+        return
+    if archive.data_version != data_version():
+        print(f"Ignoring tile archive {TILE_ARCHIVE_PATH}: built from data version {archive.data_version or 'unknown'}, serving {data_version()}.")
+        archive.close()
+        return
+    tile_archive = archive
+    print(f"Serving {len(tile_archive)} tiles for z{tile_archive.min_zoom}-z{tile_archive.max_zoom} from {TILE_ARCHIVE_PATH}.")
+
+def close_tile_archive():
+    global tile_archive
+    if tile_archive is not None:
+        tile_archive.close()
+        tile_archive = None
+
+# In-process tile cache keyed by (z, x, y, cache_version, data_version)
+tile_cache = TileCache(
+    hot_bytes=TILE_CACHE_HOT_MB * 1024 * 1024,
+    warm_bytes=TILE_CACHE_WARM_MB * 1024 * 1024,
+)
+# The shared cache, if enabled; checked after the in-process cache
+shared_tile_cache: Optional[SharedTileCache] = None
 
-@lru_cache(maxsize=2048)
-def generate_tile_content(z: int, x: int, y: int, cache_version: str) -> Optional[bytes]:
+def open_shared_cache():
+    global shared_tile_cache
+    if SHARED_CACHE_PATH:
+        shared_tile_cache = SharedTileCache(SHARED_CACHE_PATH, SHARED_CACHE_MB * 1024 * 1024)
+        print(f"Using shared tile cache at {SHARED_CACHE_PATH}.")
+
+def close_shared_cache():
+    global shared_tile_cache
+    if shared_tile_cache is not None:
+        shared_tile_cache.close()
+        shared_tile_cache = None
+
+def _cache_key(z: int, x: int, y: int, cache_version: str) -> tuple:
+    # The data version keeps tiles of a replaced database out of every cache tier
+    return (z, x, y, cache_version, data_version())
+
+def _cache_lookup(key: tuple) -> Tuple[bool, RenderedTile]:
+    """Looks a tile up in the in-process cache, then in the shared cache."""
+    hit, data, reduction = tile_cache.get_entry(key)
+    if hit:
+        return True, RenderedTile(data, reduction)
+    if shared_tile_cache is not None:
+        hit, data, reduction = shared_tile_cache.get_entry("/".join(map(str, key)))
+        if hit:
+            tile_cache.put(key, data, reduction)
+            return True, RenderedTile(data, reduction)
+    return False, RenderedTile(None, None)
+
+def _cache_store(key: tuple, tile: RenderedTile):
+    tile_cache.put(key, tile.data, tile.reduction)
+    if shared_tile_cache is not None:
+        shared_tile_cache.put("/".join(map(str, key)), tile.data, tile.reduction)
+
+def generate_tile_content(z: int, x: int, y: int, cache_version: str) -> RenderedTile:
     """
-    Cached function to generate MVT data.
+    Cached function to generate MVT data within the zoom's tile budget.
+    Failed generations are not cached so the next request retries them.
     """
-    simplification_tolerance = get_simplification_tolerance(z)
+    key = _cache_key(z, x, y, cache_version)
+    hit, tile = _cache_lookup(key)
+    if hit:
+        return tile
 
     try:
         with db_connection() as db_con:
-            # The core MVT generation query
-            # We removed the area filter to ensure full coverage
-            query = f"""
-                WITH
-                bounds_box AS (
-                    -- 1. Use Web Mercator tile bounds (EPSG:3857)
-                    -- Compute a Box2D for MVT encoding; keep the intersects predicate inline to hit RTREE.
-                    SELECT
-                        ST_Extent(ST_TileEnvelope({z}, {x}, {y})) AS box
-                ),
-                features AS (
-                    -- 2. Select features that intersect with the tile bounds
-                    SELECT
-                        t.gid,
-                        t.clave,
-                        t.uso_suelo,
-                        t.alcaldia,
-                        COALESCE(CAST(t.no_niveles AS INTEGER), 0) AS no_niveles, -- Force non-null
-                        -- 3. Use the full ST_AsMVTGeom signature for robustness
-                        ST_AsMVTGeom(
-                            ST_Simplify(t.geometry, {simplification_tolerance}),
-                            (SELECT box FROM bounds_box),
-                            4096, -- Extent
-                            256,  -- Buffer
-                            true  -- Clip Geom
-                        ) AS mvt_geom
-                    FROM {TABLE_NAME} t
-                    WHERE ST_Intersects(t.geometry, ST_TileEnvelope({z}, {x}, {y}))
-                )
-                -- 5. Aggregate the clipped geometries into a single MVT layer
-                SELECT
-                    CASE
-                        WHEN COUNT(*) = 0 THEN NULL
-                        ELSE ST_AsMVT(sub, '{LAYER_NAME}')
-                    END AS tile
-                FROM (
-                    SELECT gid, clave, uso_suelo, alcaldia, no_niveles, mvt_geom FROM features
-                    WHERE mvt_geom IS NOT NULL
-                ) AS sub;
-            """
-
-            # Execute the query
-            result = db_con.execute(query).fetchone()
-        
-        if not result or not result[0]:
-            return None
-
-        return result[0]
+            start = time.perf_counter()
+            profile = {} if tile_profiler.should_sample() else None
+            tile = render_tile(db_con, z, x, y, profile=profile)
+            latency_ms = (time.perf_counter() - start) * 1000
 
     except Exception as e:
         print(f"Error generating tile for z={z}, x={x}, y={y}: {e}")
-        return None
+        return RenderedTile(None, None)
+
+    tile_profiler.observe(z, x, y, latency_ms, profile)
+    _cache_store(key, tile)
+    return tile
+
+def profile_tile(z: int, x: int, y: int) -> Dict[str, object]:
+    """
+    Re-runs the tile query with DuckDB profiling enabled, bypassing the cache.
+    The budget is not enforced, so the re-run is not counted in the budget stats.
+    """
+    with db_connection() as db_con:
+        source = tile_source(db_con, z)
+        with duckdb_profiling(db_con) as profile:
+            fetch_tile(db_con, z, x, y, source)
+    return profile
+
+# Opt-in profiling of sampled and slow tiles (TILE_PROFILE_SAMPLE_RATE, TILE_PROFILE_SLOW_MS)
+tile_profiler = TileProfiler(profile_tile)
+
+# Background check for a replaced database file
+_data_version_stop = threading.Event()
+_data_version_thread: Optional[threading.Thread] = None
+
+def _on_database_closed():
+    """Forgets state tied to the replaced database while its connections are closed."""
+    global tile_archive
+    # Stop serving archived tiles of the old data. The archive is not closed here
+    # because a request may still be reading it; the mapping is freed with it.
+    tile_archive = None
+    # Per-connection state belongs to the connections being closed
+    reset_connection_state()
+    # Old tiles are unreachable under the new data version; dropping them also
+    # resets the admission counts they would otherwise keep winning with
+    tile_cache.clear()
+
+def _watch_data_version():
+    while not _data_version_stop.wait(DATA_VERSION_CHECK_S):
+        if database_changed():
+            try:
+                reload_db(on_closed=_on_database_closed)
+                # Serve the archive again if it was rebuilt for the new data
+                open_tile_archive()
+            except Exception as e:
+                print(f"Error reloading the database: {e}")
+
+def start_data_version_watch():
+    global _data_version_thread
+    if DATA_VERSION_CHECK_S <= 0:
+        return
+    _data_version_stop.clear()
+    _data_version_thread = threading.Thread(target=_watch_data_version, name="data-version-watch", daemon=True)
+    _data_version_thread.start()
+
+def stop_data_version_watch():
+    global _data_version_thread
+    if _data_version_thread is not None:
+        _data_version_stop.set()
+        _data_version_thread.join()
+        _data_version_thread = None
+
+def warm_tile(z: int, x: int, y: int):
+    """Renders a tile into the cache unless it is already there or archived."""
+    if tile_archive is not None and tile_archive.covers(z):
+        return
+    if not tile_cache.contains(_cache_key(z, x, y, CACHE_VERSION)):
+        generate_tile_content(z, x, y, CACHE_VERSION)
+
+# Background service prefetching likely-next tiles into the cache
+tile_warmer = TileWarmer(
+    render=warm_tile,
+    min_zoom=MIN_ZOOM,
+    max_zoom=MAX_ZOOM,
+)
 
 @app.get("/health")
 def health_check():
@@ -131,8 +301,170 @@ def health_check():
     except Exception as e:
         return {"status": "error", "message": f"Database connection failed: {e}"}
 
+@app.get("/metrics")
+def metrics():
+    """
+    Returns in-process server metrics: per-tier tile cache size, hits, misses and
+    hit ratio, and how many tiles were reduced to fit their size budget.
+    """
+    return {
+        "data_version": data_version(),
+        "tile_cache": tile_cache.stats(),
+        "shared_tile_cache": shared_tile_cache.stats() if shared_tile_cache is not None else None,
+        "tile_budget": tile_budget_stats(),
+    }
+
+@app.get("/admin/slow-tiles")
+def slow_tiles(x_admin_token: Optional[str] = Header(default=None)):
+    """
+    Returns the DuckDB profiles of the slowest sampled or slow tiles, slowest first.
+    Profiles expose query plans, so the endpoint only exists when TILE_ADMIN_TOKEN is set.
+    """
+    if not ADMIN_TOKEN:
+        return Response(status_code=404)
+    if not hmac.compare_digest((x_admin_token or "").encode(), ADMIN_TOKEN.encode()):
+        return Response(status_code=403, content="Invalid admin token.")
+    return {
+        "enabled": tile_profiler.enabled,
+        "sample_rate": tile_profiler.sample_rate,
+        "slow_ms": tile_profiler.slow_ms,
+        "keep": tile_profiler.keep,
+        "tiles": tile_profiler.slowest(),
+    }
+
+def _batch_response(coords: List[Tuple[int, int, int]], cache_version: str) -> Response:
+    """
+    Generates the requested tiles that are not cached with one spatial query
+    per zoom level and returns them in the length-prefixed batch container.
+    """
+    headers = {
+        "X-Tile-Cache-Version": cache_version,
+        "X-Tile-Server": "fastapi",
+    }
+
+    if not coords:
+        return Response(status_code=400, content="No tiles requested.", headers=headers)
+    if len(coords) > MAX_BATCH_TILES:
+        return Response(
+            status_code=400,
+            content=f"Batch of {len(coords)} tiles exceeds the limit of {MAX_BATCH_TILES}.",
+            headers=headers,
+        )
+    for z, _, _ in coords:
+        if not (MIN_ZOOM <= z <= MAX_ZOOM):
+            return Response(
+                status_code=404,
+                content=f"Zoom level {z} is outside the supported range [{MIN_ZOOM}, {MAX_ZOOM}].",
+                headers=headers,
+            )
+    for z, x, y in coords:
+        if not tile_in_range(z, x, y):
+            return Response(status_code=400, content=f"Tile {z}/{x}/{y} does not exist.", headers=headers)
+
+    # Serve what we can from the cache and query only the misses
+    tiles: Dict[Tuple[int, int, int], Optional[bytes]] = {}
+    by_zoom: Dict[int, List[Tuple[int, int]]] = {}
+    for z, x, y in dict.fromkeys(coords):
+        hit, tile = _cache_lookup(_cache_key(z, x, y, cache_version))
+        if hit:
+            tiles[(z, x, y)] = tile.data
+        else:
+            by_zoom.setdefault(z, []).append((x, y))
+
+    try:
+        if by_zoom:
+            with db_connection() as db_con:
+                for z, zoom_coords in by_zoom.items():
+                    for (x, y), tile in fetch_tiles(db_con, z, zoom_coords).items():
+                        tiles[(z, x, y)] = tile.data
+                        _cache_store(_cache_key(z, x, y, cache_version), tile)
+    except Exception as e:
+        print(f"Error generating tile batch of {len(coords)} tiles: {e}")
+        return Response(status_code=500, content="Failed to generate tile batch.", headers=headers)
+
+    headers["Cache-Control"] = "public, max-age=86400"
+    return Response(
+        content=encode_tile_batch((z, x, y, tiles[(z, x, y)]) for z, x, y in coords),
+        media_type=BATCH_MEDIA_TYPE,
+        headers=headers,
+    )
+
+@app.get("/tiles/batch", response_class=Response)
+def get_tile_batch(z: int, xmin: int, ymin: int, xmax: int, ymax: int, v: Optional[str] = None):
+    """
+    Returns every tile in the inclusive range [xmin, xmax] x [ymin, ymax] at zoom z
+    in a single length-prefixed binary container.
+    """
+    if xmax < xmin or ymax < ymin:
+        return Response(status_code=400, content="Empty tile range.")
+    if (xmax - xmin + 1) * (ymax - ymin + 1) > MAX_BATCH_TILES:
+        return Response(status_code=400, content=f"Tile range exceeds the limit of {MAX_BATCH_TILES} tiles.")
+    coords = [(z, x, y) for x in range(xmin, xmax + 1) for y in range(ymin, ymax + 1)]
+    return _batch_response(coords, v or CACHE_VERSION)
+
+@app.post("/tiles/batch", response_class=Response)
+def post_tile_batch(request: TileBatchRequest, v: Optional[str] = None):
+    """
+    Returns the listed "z/x/y" tiles in a single length-prefixed binary container,
+    in the order they were requested.
+    """
+    try:
+        coords = [tuple(int(part) for part in key.split("/")) for key in request.tiles]
+    except ValueError:
+        return Response(status_code=400, content="Tile keys must have the form z/x/y.")
+    if any(len(coord) != 3 for coord in coords):
+        return Response(status_code=400, content="Tile keys must have the form z/x/y.")
+    return _batch_response(coords, v or CACHE_VERSION)
+
+# Free export slots; a request finding none is rejected rather than queued
+_export_slots = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENT)
+
+def _stream_export(fmt: str, alcaldia: Optional[str], bbox):
+    """
+    Streams an export on its own connection, so a slow client never holds a
+    pooled one, and frees its slot when done or abandoned.
+    """
+    try:
+        with dedicated_connection() as db_con:
+            yield from export_features(db_con, fmt, alcaldia, bbox)
+    finally:
+        _export_slots.release()
+
+@app.get("/export", response_class=Response)
+def export(format: str = "ndjson", alcaldia: Optional[str] = None, bbox: Optional[str] = None):
+    """
+    Streams the parcels as line-delimited GeoJSON (ndjson) or a GeoJSON
+    FeatureCollection (geojson) in EPSG:4326, optionally filtered by alcaldía
+    and by a "minlon,minlat,maxlon,maxlat" bbox. The response is chunked and
+    produced as the client reads it, so memory use does not grow with its size.
+    """
+    if format not in EXPORT_FORMATS:
+        return Response(status_code=400, content=f"Unsupported export format '{format}'. Use one of: {', '.join(EXPORT_FORMATS)}.")
+    try:
+        bounds = parse_bbox(bbox) if bbox else None
+    except ValueError as e:
+        return Response(status_code=400, content=str(e))
+    if not _export_slots.acquire(blocking=False):
+        return Response(status_code=429, content="Too many exports in progress.", headers={"Retry-After": "30"})
+
+    chunks = _stream_export(format, alcaldia, bounds)
+    try:
+        # Run the query before sending headers so failures still get an error status
+        first = next(chunks, b"")
+    except Exception as e:
+        print(f"Error starting export (format={format}, alcaldia={alcaldia}, bbox={bbox}): {e}")
+        return Response(status_code=500, content="Failed to start export.")
+    return StreamingResponse(
+        itertools.chain([first], chunks),
+        media_type=EXPORT_FORMATS[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{TABLE_NAME}.{format}"',
+            "X-Tile-Data-Version": data_version() or "",
+        },
+    )
+
 @app.get("/tiles/{z}/{x}/{y}.pbf", response_class=Response)
-def get_tile(z: int, x: int, y: int, v: Optional[str] = None):
+def get_tile(z: int, x: int, y: int, v: Optional[str] = None, accept_encoding: Optional[str] = Header(default=None)):
     """
     Generates and returns a Mapbox Vector Tile (MVT) for the given zoom, x, and y coordinates.
     """
@@ -140,6 +472,7 @@ def get_tile(z: int, x: int, y: int, v: Optional[str] = None):
     headers = {
         "X-Tile-Cache-Version": cache_version,
         "X-Tile-Cache-Key": f"{z}/{x}/{y}/{cache_version}",
+        "X-Tile-Data-Version": data_version() or "",
         "X-Tile-Server": "fastapi",
     }
 
@@ -149,20 +482,45 @@ def get_tile(z: int, x: int, y: int, v: Optional[str] = None):
             content=f"Zoom level {z} is outside the supported range [{MIN_ZOOM}, {MAX_ZOOM}].",
             headers=headers,
         )
+    if not tile_in_range(z, x, y):
+        return Response(status_code=404, content=f"Tile {z}/{x}/{y} does not exist.", headers=headers)
+
+    # Archived zooms are served straight from the memory map
+    if tile_archive is not None and tile_archive.covers(z) and cache_version == CACHE_VERSION:
+        headers["X-Tile-Source"] = "archive"
+        archived_tile = tile_archive.get(z, x, y)
+        if archived_tile is None:
+            return Response(status_code=204, headers=headers)
+        headers["Cache-Control"] = "public, max-age=86400"
+        headers["Vary"] = "Accept-Encoding"
+        if "gzip" not in (accept_encoding or ""):
+            # Rare clients without gzip support get a decompressed copy
+            return Response(content=gzip.decompress(archived_tile), media_type=ArchiveTileResponse.media_type, headers=headers)
+        headers["Content-Encoding"] = "gzip"
+        return ArchiveTileResponse(content=archived_tile, headers=headers)
+
+    tile = generate_tile_content(z, x, y, cache_version)
 
-    raw_tile_data = generate_tile_content(z, x, y, cache_version)
-    
-    if raw_tile_data is None:
+    # Only tiles of the current version are tracked and prefetched
+    if cache_version == CACHE_VERSION:
+        tile_warmer.record(z, x, y)
+        tile_warmer.prefetch_around(z, x, y)
+
+    if tile.data is None:
          # If no features are in this tile, return an empty response with a 204 status
         return Response(status_code=204, headers=headers)
 
+    # Report how the tile was reduced to fit its size budget
+    if tile.reduction:
+        headers["X-Tile-Reduction"] = tile.reduction
+
     # Add Cache-Control header
     # We cache tiles for 1 day (86400 seconds) because they are static
     headers["Cache-Control"] = "public, max-age=86400"
 
     # FastAPI's GZipMiddleware will handle the gzipping and Content-Encoding header
     return Response(
-        content=raw_tile_data,
+        content=tile.data,
         media_type="application/vnd.mapbox-vector-tile",
         headers=headers,
         # No manual Content-Encoding: gzip header here, GZipMiddleware handles it
@@ -0,0 +1,142 @@
+import duckdb
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+from .db import BACKGROUND_MIN_IDLE, idle_connections
+
+# --- Constants ---
+# Fraction of generated tiles whose query is profiled (0 disables sampling)
+PROFILE_SAMPLE_RATE = float(os.getenv("TILE_PROFILE_SAMPLE_RATE", "0"))
+# Tiles slower than this many milliseconds are re-run with profiling (0 disables)
+PROFILE_SLOW_MS = float(os.getenv("TILE_PROFILE_SLOW_MS", "0"))
+# Number of slowest profiled tiles kept in memory
+PROFILE_KEEP = int(os.getenv("TILE_PROFILE_KEEP", "20"))
+# Query-level timings copied from DuckDB's JSON profile
+_QUERY_METRICS = ("latency", "planner", "planner_binding", "all_optimizers", "physical_planner", "rows_returned")
+# Operator-level metrics copied from each node of the profile tree
+_OPERATOR_METRICS = ("operator_type", "operator_timing", "operator_cardinality", "operator_rows_scanned", "extra_info")
+
+def summarize_profile(profile: Dict[str, object]) -> Dict[str, object]:
+    """
+    Reduces DuckDB's JSON profile to the query-level timings and a flat,
+    depth-annotated list of operators with their time and row counts.
+    """
+    operators = []
+
+    def walk(node: Dict[str, object], depth: int):
+        for child in node.get("children", []):
+            operators.append({"depth": depth, **{k: child.get(k) for k in _OPERATOR_METRICS if k in child}})
+            walk(child, depth + 1)
+
+    walk(profile, 0)
+    summary = {k: profile.get(k) for k in _QUERY_METRICS if k in profile}
+    summary["operators"] = operators
+    return summary
+
+@contextmanager
+def duckdb_profiling(db_con: duckdb.DuckDBPyConnection):
+    """
+    Enables detailed profiling on a borrowed connection for the duration of the
+    block and fills the yielded dict with the summary of the last query run.
+    """
+    db_con.execute("SET enable_profiling = 'no_output';")
+    db_con.execute("SET profiling_mode = 'detailed';")
+    profile: Dict[str, object] = {}
+    try:
+        yield profile
+        profile.update(summarize_profile(json.loads(db_con.get_profiling_information(format="json"))))
+    finally:
+        db_con.execute("RESET enable_profiling;")
+        db_con.execute("RESET profiling_mode;")
+
+class TileProfiler:
+    """
+    Keeps the profiles of the slowest tiles seen, collected either by sampling
+    a fraction of tile generations or by re-running tiles that exceeded the
+    latency threshold with profiling enabled.
+    """
+
+    def __init__(self, profile_tile: Callable[[int, int, int], Dict[str, object]],
+                 sample_rate: float = PROFILE_SAMPLE_RATE, slow_ms: float = PROFILE_SLOW_MS,
+                 keep: int = PROFILE_KEEP):
+        self._profile_tile = profile_tile
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.keep = keep
+        # Min-heap of (latency, sequence, entry); the root is the fastest kept tile
+        self._slowest: List[tuple] = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 or self.slow_ms > 0
+
+    def start(self):
+        if self.slow_ms > 0:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tile-profiler")
+
+    def stop(self):
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def should_sample(self) -> bool:
+        """Decides whether the next tile generation runs with profiling."""
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def observe(self, z: int, x: int, y: int, latency_ms: float, profile: Optional[Dict[str, object]] = None):
+        """
+        Records a generated tile. Sampled tiles arrive with their profile; slow
+        unsampled tiles are queued for a profiled re-run in the background.
+        """
+        if profile is not None:
+            self._record(z, x, y, latency_ms, "sampled", profile)
+        elif self.slow_ms > 0 and latency_ms >= self.slow_ms and self._executor is not None:
+            try:
+                self._executor.submit(self._profile_slow, z, x, y, latency_ms)
+            except RuntimeError:
+                # The executor was shut down while the tile was being generated
+                pass
+
+    def slowest(self) -> List[Dict[str, object]]:
+        """Returns the kept profiles, slowest first."""
+        with self._lock:
+            return [entry for _, _, entry in sorted(self._slowest, reverse=True)]
+
+    def clear(self):
+        with self._lock:
+            self._slowest.clear()
+
+    def _profile_slow(self, z: int, x: int, y: int, latency_ms: float):
+        profile = None
+        try:
+            # Like prefetching, a profiled re-run must not take the last free connections
+            if idle_connections() >= BACKGROUND_MIN_IDLE:
+                profile = self._profile_tile(z, x, y)
+        except Exception as e:
+            print(f"Error profiling slow tile z={z}, x={x}, y={y}: {e}")
+        self._record(z, x, y, latency_ms, "slow", profile)
+
+    def _record(self, z: int, x: int, y: int, latency_ms: float, reason: str, profile: Optional[Dict[str, object]]):
+        entry = {
+            "tile": f"{z}/{x}/{y}",
+            "latency_ms": round(latency_ms, 3),
+            "reason": reason,
+            "recorded_at": time.time(),
+            "profile": profile,
+        }
+        with self._lock:
+            item = (latency_ms, next(self._sequence), entry)
+            if len(self._slowest) < self.keep:
+                heapq.heappush(self._slowest, item)
+            elif latency_ms > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, item)
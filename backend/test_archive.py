@@ -0,0 +1,93 @@
+import gzip
+import pytest
+from fastapi.testclient import TestClient
+import backend.main as main
+from backend.archive import ARCHIVE_VERSION, TileArchive, tile_key, write_archive
+from backend.db import data_version
+
+def test_tile_key_sorts_by_zoom_x_y():
+    """Test that tile keys order tiles by zoom, then x, then y."""
+    assert tile_key(14, 0, 5) < tile_key(14, 1, 0) < tile_key(15, 0, 0)
+    with pytest.raises(ValueError):
+        tile_key(14, 2 ** 24, 0)
+
+def test_archive_roundtrip(tmp_path):
+    """Test writing an archive and reading tiles back as zero-copy views."""
+    path = str(tmp_path / "tiles.archive")
+    tiles = [(14, 3, 2, b"tile-a"), (14, 1, 9, b"tile-b"), (15, 0, 0, b""), (15, 7, 7, b"tile-c")]
+    assert write_archive(path, tiles, 14, 15, "abc-123") == 3
+
+    archive = TileArchive(path)
+    assert len(archive) == 3
+    assert archive.data_version == "abc-123"
+    assert archive.covers(15) and not archive.covers(16)
+    tile = archive.get(14, 1, 9)
+    assert isinstance(tile, memoryview)
+    assert gzip.decompress(tile) == b"tile-b"
+    assert gzip.decompress(archive.get(15, 7, 7)) == b"tile-c"
+    assert archive.get(15, 0, 0) is None
+    assert archive.get(14, 2, 2) is None
+    # Out-of-range coordinates must not alias tiles of another zoom
+    assert archive.get(14, 2 ** 24 + 7, 7) is None
+    assert archive.get(14, -1, 9) is None
+    tile.release()
+    archive.close()
+
+def test_unreadable_archive_is_rejected_and_not_served(tmp_path, monkeypatch):
+    """Test that empty, truncated and stale-format archives raise ValueError and the server falls back to DuckDB."""
+    path = tmp_path / "tiles.archive"
+    write_archive(str(path), [(14, 1, 1, b"tile-a"), (14, 2, 2, b"tile-b")], 14, 14, "abc-123")
+    valid = path.read_bytes()
+    stale = bytearray(valid)
+    stale[4:6] = (ARCHIVE_VERSION - 1).to_bytes(2, "little")
+    monkeypatch.setattr(main, "TILE_ARCHIVE_PATH", str(path))
+    monkeypatch.setattr(main, "tile_archive", None)
+
+    for content in (b"", valid[:10], valid[:60], bytes(stale)):
+        path.write_bytes(content)
+        with pytest.raises(ValueError):
+            TileArchive(str(path))
+        main.open_tile_archive()
+        assert main.tile_archive is None
+
+def test_get_tile_serves_archived_zooms(tmp_path, monkeypatch):
+    """Test that archived zooms are answered from the archive instead of DuckDB."""
+    path = str(tmp_path / "tiles.archive")
+    monkeypatch.setattr(main, "TILE_ARCHIVE_PATH", path)
+
+    with TestClient(main.app) as client:
+        write_archive(path, [(14, 5, 5, b"archived-tile")], 14, 14, data_version())
+        main.open_tile_archive()
+        response = client.get("/tiles/14/5/5.pbf")
+        assert response.status_code == 200
+        assert response.headers["x-tile-source"] == "archive"
+        assert response.headers["content-type"] == "application/vnd.mapbox-vector-tile"
+        # Sent as stored, not gzipped again by the middleware; httpx decompresses it
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.content == b"archived-tile"
+
+        identity = client.get("/tiles/14/5/5.pbf", headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in identity.headers
+        assert identity.content == b"archived-tile"
+
+        empty = client.get("/tiles/14/6/6.pbf")
+        assert empty.status_code == 204
+        # Zooms outside the archive still go to the database
+        assert "x-tile-source" not in client.get("/tiles/15/0/0.pbf").headers
+
+def test_archive_of_other_data_version_is_not_served(tmp_path, monkeypatch):
+    """Test that an archive built from another database is ignored, and dropped when the database is replaced."""
+    path = str(tmp_path / "tiles.archive")
+    monkeypatch.setattr(main, "TILE_ARCHIVE_PATH", path)
+
+    with TestClient(main.app) as client:
+        write_archive(path, [(14, 5, 5, b"archived-tile")], 14, 14, "stale-version")
+        main.open_tile_archive()
+        assert main.tile_archive is None
+        assert "x-tile-source" not in client.get("/tiles/14/5/5.pbf").headers
+
+        write_archive(path, [(14, 5, 5, b"archived-tile")], 14, 14, data_version())
+        main.open_tile_archive()
+        assert client.get("/tiles/14/5/5.pbf").headers["x-tile-source"] == "archive"
+        main._on_database_closed()
+        assert "x-tile-source" not in client.get("/tiles/14/5/5.pbf").headers
@@ -0,0 +1,102 @@
+from backend.cache import ENTRY_OVERHEAD, FrequencySketch, SharedTileCache, TileCache
+
+def _tile(i: int, size: int = 200) -> bytes:
+    return bytes([i % 256]) * size
+
+def test_frequency_sketch_counts_and_ages():
+    """Test that the sketch estimates access counts and halves them when aging."""
+    sketch = FrequencySketch(width=64, sample_size=1000)
+    for _ in range(6):
+        sketch.increment("hot")
+    sketch.increment("cold")
+    assert sketch.estimate("hot") >= 6
+    assert sketch.estimate("cold") >= 1
+    sketch._age()
+    assert 3 <= sketch.estimate("hot") < 6
+
+def test_cache_hit_miss_and_empty_tiles():
+    """Test that misses, hits and cached empty (None) tiles are reported per tier."""
+    cache = TileCache(hot_bytes=10_000, warm_bytes=10_000)
+    assert cache.get("a") == (False, None)
+    cache.put("a", _tile(1))
+    cache.put("empty", None)
+    assert cache.get("a") == (True, _tile(1))
+    assert cache.get("empty") == (True, None)
+    stats = cache.stats()
+    assert stats["hot"]["hits"] == 2
+    assert stats["hot"]["misses"] == 1
+    assert stats["hot"]["size_bytes"] == 2 * ENTRY_OVERHEAD + 200
+
+def test_cache_respects_byte_budget_and_demotes_to_warm():
+    """Test that the hot tier stays within budget and evicted tiles stay readable from the warm tier."""
+    cache = TileCache(hot_bytes=3 * (ENTRY_OVERHEAD + 200), warm_bytes=100_000)
+    for i in range(10):
+        key = ("tile", i)
+        # Later tiles are requested more often, so they win admission
+        for _ in range(i + 1):
+            cache.get(key)
+        cache.put(key, _tile(i))
+
+    stats = cache.stats()
+    assert stats["hot"]["size_bytes"] <= stats["hot"]["budget_bytes"]
+    assert stats["hot"]["entries"] == 3
+    assert stats["warm"]["entries"] == 7
+    # Warm entries are compressed
+    assert stats["warm"]["size_bytes"] < 7 * (ENTRY_OVERHEAD + 200)
+    for i in range(10):
+        assert cache.contains(("tile", i))
+    assert cache.get(("tile", 0)) == (True, _tile(0))
+    assert cache.stats()["warm"]["hits"] == 1
+
+def test_cache_admission_rejects_infrequent_tiles():
+    """Test that a one-off tile does not evict a frequently requested one."""
+    cache = TileCache(hot_bytes=ENTRY_OVERHEAD + 200, warm_bytes=ENTRY_OVERHEAD + 10)
+    for _ in range(5):
+        cache.get("popular")
+    cache.put("popular", _tile(1))
+    cache.get("one-off")
+    cache.put("one-off", _tile(2))
+    assert cache.get("popular") == (True, _tile(1))
+    assert cache.stats()["hot"]["entries"] == 1
+
+def test_clear_resets_admission_counts():
+    """Test that after clear() new tiles are admitted even if the dropped ones were popular."""
+    cache = TileCache(hot_bytes=3 * (ENTRY_OVERHEAD + 200), warm_bytes=3 * (ENTRY_OVERHEAD + 200))
+    for i in range(6):
+        for _ in range(10):
+            cache.get(("old", i))
+        cache.put(("old", i), _tile(i))
+    cache.clear()
+    assert cache.stats()["hot"]["entries"] == cache.stats()["warm"]["entries"] == 0
+    assert cache._sketch.estimate(("old", 0)) == 0
+
+    for i in range(6):
+        cache.put(("new", i), _tile(i))
+    assert all(cache.contains(("new", i)) for i in range(6))
+
+def test_shared_cache_is_visible_across_instances(tmp_path):
+    """Test that tiles written by one worker's cache are read by another's."""
+    path = str(tmp_path / "shared.sqlite")
+    writer = SharedTileCache(path, budget_bytes=1_000_000)
+    reader = SharedTileCache(path, budget_bytes=1_000_000)
+    writer.put("14/1/2/1/v1", _tile(3), "tolerance=2x;min_area=1px")
+    writer.put("14/0/0/1/v1", None)
+    assert reader.get_entry("14/1/2/1/v1") == (True, _tile(3), "tolerance=2x;min_area=1px")
+    assert reader.get_entry("14/0/0/1/v1") == (True, None, None)
+    # A different data version is a different key
+    assert reader.get_entry("14/1/2/1/v2") == (False, None, None)
+    assert reader.stats()["hits"] == 2
+    writer.close()
+    reader.close()
+
+def test_shared_cache_prunes_oldest_tiles(tmp_path):
+    """Test that pruning deletes the oldest tiles until the cache fits its budget."""
+    cache = SharedTileCache(str(tmp_path / "shared.sqlite"), budget_bytes=2_000)
+    for i in range(50):
+        cache.put(f"tile-{i}", bytes(range(256)) * 2)
+    cache.prune()
+    stats = cache.stats()
+    assert 0 < stats["size_bytes"] <= 2_000
+    assert cache.get_entry("tile-49")[0]
+    assert not cache.get_entry("tile-0")[0]
+    cache.close()
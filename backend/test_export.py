@@ -0,0 +1,126 @@
+import duckdb
+import json
+import pytest
+import shutil
+import threading
+from fastapi.testclient import TestClient
+import backend.main as main
+from backend import db
+from backend.db import TABLE_NAME, WEB_MERCATOR_HALF_WORLD, db_connection
+from backend.export import EXPORT_BATCH_ROWS, export_features, lonlat_to_mercator, parse_bbox
+
+@pytest.fixture
+def multi_batch_db(tmp_path, monkeypatch):
+    """Serves a copy of the database with enough parcels for an export of several batches."""
+    path = tmp_path / "mexico_city.duckdb"
+    shutil.copy(db.DB_PATH, path)
+    con = duckdb.connect(str(path))
+    try:
+        con.execute("INSTALL spatial;")
+        con.execute("LOAD spatial;")
+        con.execute(f"""
+            INSERT INTO {TABLE_NAME}
+            SELECT gid + i * 1000000, clave, uso_suelo, alcaldia, no_niveles, geometry
+            FROM {TABLE_NAME}, range(1, {2 * EXPORT_BATCH_ROWS}) r(i);
+        """)
+    finally:
+        con.close()
+    monkeypatch.setattr(db, "DB_PATH", str(path))
+
+def test_parse_bbox_validates_order_and_range():
+    """Test that bboxes are parsed as minlon,minlat,maxlon,maxlat and rejected when malformed."""
+    assert parse_bbox("-99.3,19.2,-98.9,19.6") == (-99.3, 19.2, -98.9, 19.6)
+    for text in ("-99.3,19.2,-98.9", "a,b,c,d", "-98.9,19.2,-99.3,19.6", "-99.3,19.2,-98.9,95"):
+        with pytest.raises(ValueError):
+            parse_bbox(text)
+
+def test_lonlat_to_mercator():
+    """Test the Web Mercator projection at the origin and the antimeridian."""
+    assert lonlat_to_mercator(0, 0) == pytest.approx((0, 0), abs=1e-6)
+    assert lonlat_to_mercator(180, 0)[0] == pytest.approx(WEB_MERCATOR_HALF_WORLD)
+
+def test_export_streams_in_batches():
+    """Test that an export yields one chunk per record batch and covers every parcel."""
+    with TestClient(main.app):
+        with db_connection() as con:
+            count = con.execute(f"SELECT COUNT(*) FROM {TABLE_NAME};").fetchone()[0]
+            chunks = list(export_features(con, "ndjson", batch_rows=1))
+    lines = [line for chunk in chunks for line in chunk.splitlines()]
+    assert len(chunks) == len(lines) == count
+    feature = json.loads(lines[0])
+    assert feature["type"] == "Feature"
+    assert set(feature["properties"]) == {"gid", "clave", "uso_suelo", "alcaldia", "no_niveles"}
+
+def test_export_endpoint_geojson_with_filters():
+    """Test that the endpoint streams a valid FeatureCollection in EPSG:4326 and applies its filters."""
+    with TestClient(main.app) as client:
+        with db_connection() as con:
+            alcaldia, count = con.execute(
+                f"SELECT CAST(alcaldia AS VARCHAR), COUNT(*) FROM {TABLE_NAME} GROUP BY 1 ORDER BY 2 DESC LIMIT 1;"
+            ).fetchone()
+
+        response = client.get("/export", params={"format": "geojson", "alcaldia": alcaldia, "bbox": "-180,-85,180,85"})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/geo+json")
+        collection = response.json()
+        assert collection["type"] == "FeatureCollection"
+        assert len(collection["features"]) == count
+        lon, lat = _first_coordinate(collection["features"][0]["geometry"])
+        assert -180 <= lon <= 180 and -90 <= lat <= 90
+
+        # A bbox away from the data exports nothing
+        empty = client.get("/export", params={"bbox": "0,0,1,1"})
+        assert empty.status_code == 200
+        assert empty.content == b""
+
+def test_export_endpoint_rejects_invalid_requests():
+    """Test the errors for unknown formats, bad bboxes and too many concurrent exports."""
+    with TestClient(main.app) as client:
+        assert client.get("/export", params={"format": "flatgeobuf"}).status_code == 400
+        assert client.get("/export", params={"bbox": "1,2,3"}).status_code == 400
+
+        slots = [main._export_slots.acquire(blocking=False) for _ in range(main.EXPORT_MAX_CONCURRENT)]
+        try:
+            response = client.get("/export")
+            assert response.status_code == 429
+            assert "retry-after" in response.headers
+        finally:
+            for _ in slots:
+                main._export_slots.release()
+        assert client.get("/export").status_code == 200
+
+def _first_coordinate(geometry):
+    coordinates = geometry["coordinates"]
+    while isinstance(coordinates[0], list):
+        coordinates = coordinates[0]
+    return coordinates
+
+def test_export_uses_its_own_connection_and_is_cut_off_by_reload():
+    """Test that a running export does not hold a pooled connection and is closed when the database is reloaded."""
+    with TestClient(main.app) as client:
+        with client.stream("GET", "/export") as response:
+            assert response.status_code == 200
+            assert db.idle_connections() == db.POOL_SIZE
+            db.reload_db(on_closed=main._on_database_closed)
+            assert not db._dedicated
+        assert client.get("/health").json()["status"] == "ok"
+
+def test_reload_cuts_off_an_export_suspended_between_batches(multi_batch_db):
+    """Test that a reload does not wait for an export parked between batches, which then ends with an error."""
+    with TestClient(main.app) as client:
+        assert main._export_slots.acquire(blocking=False)
+        chunks = main._stream_export("ndjson", None, None)
+        next(chunks)
+
+        reload = threading.Thread(target=db.reload_db, kwargs={"on_closed": main._on_database_closed}, daemon=True)
+        reload.start()
+        reload.join(timeout=10)
+        assert not reload.is_alive()
+        assert db.idle_connections() == db.POOL_SIZE
+
+        with pytest.raises(RuntimeError):
+            next(chunks)
+        # The failed export gave its slot back
+        assert main._export_slots.acquire(blocking=False)
+        main._export_slots.release()
+        assert client.get("/health").json()["status"] == "ok"
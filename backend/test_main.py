@@ -1,8 +1,18 @@
+import duckdb
 import pytest
 from fastapi.testclient import TestClient
 import gzip
-from backend.main import app
+import json
+import time
+from backend.main import app, profile_tile
+import os
+import shutil
+from backend import db
 from backend.db import db_connection, get_db_connection, release_db_connection, POOL_SIZE, TABLE_NAME
+from backend import warming
+from backend.warming import TileWarmer, neighbor_tiles
+from backend import tiles
+from backend.tiles import TileBudget, build_tile_query, decode_tile_batch, encode_tile_batch, fetch_tile
 
 # By using a 'with' statement, we ensure that the app's lifespan events
 # (startup and shutdown) are triggered during the tests.
@@ -36,6 +46,14 @@ def _tile_coords_for_point_3857(x: float, y: float, z: int) -> tuple[int, int]:
     ytile = int((WEB_MERCATOR_HALF_WORLD - y) / (2 * WEB_MERCATOR_HALF_WORLD) * n)
     return xtile, ytile
 
+def _data_center_tile(con, z: int) -> tuple[int, int]:
+    """Returns the zoom `z` tile containing the center of the combined extent of all parcels."""
+    xmin, ymin, xmax, ymax = con.execute(
+        f"SELECT ST_XMin(ext), ST_YMin(ext), ST_XMax(ext), ST_YMax(ext) "
+        f"FROM (SELECT ST_Extent_Agg(geometry) AS ext FROM {TABLE_NAME});"
+    ).fetchone()
+    return _tile_coords_for_point_3857((xmin + xmax) / 2, (ymin + ymax) / 2, z)
+
 def test_get_valid_tile():
     """Test requesting a valid, non-empty tile."""
     with TestClient(app) as client:
@@ -85,6 +103,12 @@ def test_get_tile_invalid_zoom():
         response_high = client.get(f"/tiles/{invalid_high_zoom}/0/0.pbf")
         assert response_high.status_code == 404
 
+def test_get_tile_out_of_range_coordinates():
+    """Test that x/y outside the zoom level's tile grid are rejected with 404."""
+    with TestClient(app) as client:
+        assert client.get("/tiles/14/-1/0.pbf").status_code == 404
+        assert client.get(f"/tiles/14/0/{2 ** 14}.pbf").status_code == 404
+
 def test_connection_pool_borrows():
     """Test borrowing and releasing all pooled connections."""
     with TestClient(app):
@@ -96,3 +120,302 @@ def test_connection_pool_borrows():
 
         for con in borrowed:
             release_db_connection(con)
+
+def test_fetch_tile_matches_literal_query():
+    """Test that fetch_tile returns the same tile as the literal SQL for its source table."""
+    with TestClient(app):
+        with db_connection() as con:
+            tile_x, tile_y = _data_center_tile(con, VALID_TILE_Z)
+
+            source = tiles.tile_source(con, VALID_TILE_Z)
+            literal = con.execute(build_tile_query(VALID_TILE_Z, tile_x, tile_y, source)).fetchone()[0]
+            assert fetch_tile(con, VALID_TILE_Z, tile_x, tile_y) == literal
+            assert fetch_tile(con, VALID_TILE_Z, 0, 0) is None
+
+# --- Batch Endpoint Tests ---
+
+def test_tile_batch_container_roundtrip():
+    """Test that the batch container preserves tile order and empty tiles."""
+    tiles = [(14, 1, 2, b"abc"), (15, 3, 4, None), (16, 5, 6, b"\x00\x01")]
+    decoded = decode_tile_batch(encode_tile_batch(tiles))
+    assert decoded == [(14, 1, 2, b"abc"), (15, 3, 4, b""), (16, 5, 6, b"\x00\x01")]
+
+def test_get_tile_batch_range():
+    """Test fetching a 2x2 tile range that contains the data extent center."""
+    with TestClient(app) as client:
+        with db_connection() as con:
+            tile_x, tile_y = _data_center_tile(con, VALID_TILE_Z)
+
+        response = client.get(
+            f"/tiles/batch?z={VALID_TILE_Z}&xmin={tile_x}&ymin={tile_y}&xmax={tile_x + 1}&ymax={tile_y + 1}"
+        )
+        assert response.status_code == 200
+        tiles = {(z, x, y): data for z, x, y, data in decode_tile_batch(response.content)}
+        assert len(tiles) == 4
+        assert len(tiles[(VALID_TILE_Z, tile_x, tile_y)]) > 0
+
+def test_post_tile_batch_list():
+    """Test fetching an explicit list of tiles, including an empty one."""
+    with TestClient(app) as client:
+        response = client.post("/tiles/batch", json={"tiles": ["14/0/0", "15/0/0"]})
+        assert response.status_code == 200
+        assert decode_tile_batch(response.content) == [(14, 0, 0, b""), (15, 0, 0, b"")]
+
+def test_fetch_tiles_renders_scattered_tiles_per_block():
+    """Test that scattered tiles on the parcel table are rendered per block and match single-tile rendering."""
+    with TestClient(app):
+        with db_connection() as con:
+            tile_x, tile_y = _data_center_tile(con, VALID_TILE_Z)
+            far = tiles.BATCH_BLOCK_TILES * 10
+            coords = [(tile_x, tile_y), (tile_x + 1, tile_y), (tile_x + far, tile_y + far)]
+            rendered = tiles.fetch_tiles(con, VALID_TILE_Z, coords, TABLE_NAME)
+            for x, y in coords:
+                single = tiles.render_tile(con, VALID_TILE_Z, x, y, TABLE_NAME)
+                assert (rendered[(x, y)].data is None) == (single.data is None)
+
+def test_tile_batch_rejects_invalid_requests():
+    """Test batch validation: malformed keys, oversized ranges, invalid zooms and out-of-range tiles."""
+    with TestClient(app) as client:
+        assert client.post("/tiles/batch", json={"tiles": ["14/0"]}).status_code == 400
+        assert client.get("/tiles/batch?z=14&xmin=0&ymin=0&xmax=99&ymax=99").status_code == 400
+        assert client.post("/tiles/batch", json={"tiles": ["5/0/0"]}).status_code == 404
+        # Coordinates outside the grid would not fit the container's unsigned fields
+        assert client.post("/tiles/batch", json={"tiles": ["14/-1/0"]}).status_code == 400
+        assert client.get("/tiles/batch?z=14&xmin=-1&ymin=0&xmax=0&ymax=0").status_code == 400
+
+# --- Prefetch and Warming Tests ---
+
+def _wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def test_neighbor_tiles():
+    """Test that neighbors stay inside the grid and children stop at the max zoom."""
+    assert len(neighbor_tiles(14, 10, 10, max_zoom=18)) == 12
+    assert (15, 20, 21) in neighbor_tiles(14, 10, 10, max_zoom=18)
+    assert len(neighbor_tiles(18, 0, 0, max_zoom=18)) == 3
+
+def test_tile_warmer_prefetches_and_persists_hot_list(tmp_path):
+    """Test prefetching around a tile and warming from the previous run's hot list."""
+    hot_list = tmp_path / "hot_tiles.json"
+    rendered = []
+    with TestClient(app):
+        warmer = TileWarmer(lambda z, x, y: rendered.append((z, x, y)), 14, 18, hot_list_path=str(hot_list))
+        warmer.start()
+        warmer.record(14, 10, 10)
+        warmer.record(14, 10, 10)
+        warmer.record(15, 1, 1)
+        warmer.prefetch_around(14, 10, 10)
+        assert _wait_for(lambda: len(rendered) == 12)
+        warmer.stop()
+        assert json.loads(hot_list.read_text()) == [[14, 10, 10], [15, 1, 1]]
+
+        rendered.clear()
+        restarted = TileWarmer(lambda z, x, y: rendered.append((z, x, y)), 14, 18, hot_list_path=str(hot_list))
+        restarted.start()
+        assert _wait_for(lambda: len(rendered) == 2)
+        restarted.stop()
+        assert set(rendered) == {(14, 10, 10), (15, 1, 1)}
+
+def test_tile_warmer_warms_the_whole_hot_list(tmp_path, monkeypatch):
+    """Test that a hot list longer than the prefetch queue is warmed completely, a batch at a time."""
+    monkeypatch.setattr(warming, "idle_connections", lambda: POOL_SIZE)
+    hot_list = tmp_path / "hot_tiles.json"
+    hot_list.write_text(json.dumps([[14, x, 0] for x in range(500)]))
+    rendered = []
+    warmer = TileWarmer(lambda z, x, y: rendered.append((z, x, y)), 14, 18, hot_list_path=str(hot_list), top_k=500)
+    warmer.start()
+    assert _wait_for(lambda: len(rendered) == 500)
+    warmer.stop()
+    assert set(rendered) == {(14, x, 0) for x in range(500)}
+
+def test_tile_warmer_bounds_request_counts():
+    """Test that counting requests for many distinct tiles keeps a bounded number of counters."""
+    warmer = TileWarmer(lambda z, x, y: None, 14, 18, top_k=10)
+    for _ in range(3):
+        warmer.record(14, 0, 0)
+    for x in range(1, 1000):
+        warmer.record(14, x, 0)
+    assert len(warmer._counts) <= warming.COUNTS_PER_HOT_TILE * 10
+    assert warmer.hot_tiles(1) == [(14, 0, 0)]
+
+# --- Tile Budget Tests ---
+
+def test_over_budget_tile_is_reduced_and_reported(monkeypatch):
+    """Test that a tile over its zoom budget is re-rendered with reductions and reported."""
+    monkeypatch.setitem(tiles.TILE_BUDGETS, VALID_TILE_Z, TileBudget(max_bytes=1, max_features=0))
+    with TestClient(app) as client:
+        with db_connection() as con:
+            tile_x, tile_y = _data_center_tile(con, VALID_TILE_Z)
+        before = client.get("/metrics").json()["tile_budget"]
+
+        # A dedicated cache version keeps earlier tests' cached tile out of the way
+        response = client.get(f"/tiles/{VALID_TILE_Z}/{tile_x}/{tile_y}.pbf?v=budget-test")
+        assert response.status_code == 200
+        # No reduction can fit a 1-byte budget, so the most reduced tile is served
+        assert response.headers["x-tile-reduction"] == "tolerance=8x;min_area=16px"
+
+        after = client.get("/metrics").json()["tile_budget"]
+        assert after["over_budget"] == before["over_budget"] + 1
+        assert after["still_over_budget"] == before["still_over_budget"] + 1
+
+        # The reduction is cached along with the tile
+        cached = client.get(f"/tiles/{VALID_TILE_Z}/{tile_x}/{tile_y}.pbf?v=budget-test")
+        assert cached.headers["x-tile-reduction"] == "tolerance=8x;min_area=16px"
+
+def test_profiled_over_budget_tile_keeps_first_query_profile(monkeypatch):
+    """Test that profiling an over-budget tile keeps the first query's profile and a slow re-run is not counted."""
+    monkeypatch.setitem(tiles.TILE_BUDGETS, VALID_TILE_Z, TileBudget(max_bytes=1, max_features=0))
+    with TestClient(app) as client:
+        with db_connection() as con:
+            tile_x, tile_y = _data_center_tile(con, VALID_TILE_Z)
+            profile = {}
+            tile = tiles.render_tile(con, VALID_TILE_Z, tile_x, tile_y, profile=profile)
+        assert tile.reduction is not None
+        assert "operators" in profile
+
+        before = client.get("/metrics").json()["tile_budget"]
+        profile = profile_tile(VALID_TILE_Z, tile_x, tile_y)
+        assert "operators" in profile
+        assert client.get("/metrics").json()["tile_budget"] == before
+
+# --- Data Version Tests ---
+
+@pytest.fixture
+def copied_db(tmp_path, monkeypatch):
+    """Serves a copy of the database, so touching it does not change the real file's data version."""
+    path = tmp_path / "mexico_city.duckdb"
+    shutil.copy(db.DB_PATH, path)
+    monkeypatch.setattr(db, "DB_PATH", str(path))
+
+def test_reload_db_picks_up_new_data_version(copied_db):
+    """Test that a changed database file is detected and the pool is reopened under a new data version."""
+    with TestClient(app) as client:
+        old_version = db.data_version()
+        assert client.get("/tiles/14/0/0.pbf").headers["x-tile-data-version"] == old_version
+
+        stat = os.stat(db.DB_PATH)
+        os.utime(db.DB_PATH, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        assert db.database_changed()
+
+        db.reload_db()
+        assert not db.database_changed()
+        assert db.data_version() != old_version
+        assert client.get("/health").json()["status"] == "ok"
+        assert client.get("/tiles/14/0/0.pbf").headers["x-tile-data-version"] == db.data_version()
+
+def test_failed_reload_keeps_old_version_and_retries(copied_db, monkeypatch):
+    """Test that a reload that cannot open the new file keeps the old data version so the next check retries."""
+    with TestClient(app) as client:
+        old_version = db.data_version()
+        stat = os.stat(db.DB_PATH)
+        os.utime(db.DB_PATH, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2_000_000_000))
+
+        def failing_checks(con):
+            raise RuntimeError("sanity check failed")
+
+        with monkeypatch.context() as patch:
+            patch.setattr(db, "_perform_sanity_checks", failing_checks)
+            with pytest.raises(RuntimeError):
+                db.reload_db(on_closed=tiles.reset_connection_state)
+            assert db.data_version() == old_version
+            assert db.database_changed()
+
+        db.reload_db(on_closed=tiles.reset_connection_state)
+        assert not db.database_changed()
+        assert client.get("/health").json()["status"] == "ok"
+
+# --- Schema Tests ---
+
+def test_table_has_compact_schema():
+    """Test that ingestion keeps only served columns, with ENUM categories and integer levels."""
+    with TestClient(app):
+        with db_connection() as con:
+            column_types = dict(con.execute(
+                "SELECT column_name, data_type FROM information_schema.columns WHERE table_name = ? ORDER BY ordinal_position;",
+                [TABLE_NAME],
+            ).fetchall())
+            assert list(column_types) == list(db.SERVED_COLUMNS)
+            assert column_types["uso_suelo"].startswith("ENUM")
+            assert column_types["alcaldia"].startswith("ENUM")
+            assert column_types["no_niveles"] == "INTEGER"
+            assert con.execute(f"SELECT COUNT(*) FROM {TABLE_NAME} WHERE no_niveles IS NULL;").fetchone()[0] == 0
+
+def test_failed_create_table_keeps_previous_tables(tmp_path):
+    """Test that a migration failing midway rolls back and leaves the served and pre-tiled tables intact."""
+    con = duckdb.connect(str(tmp_path / "migration.duckdb"))
+    try:
+        con.execute("INSTALL spatial;")
+        con.execute("LOAD spatial;")
+        db.create_table(con, """(
+            SELECT 1 AS gid, 'a' AS clave, 'H' AS uso_suelo, 'Coyoacán' AS alcaldia, '2' AS no_niveles,
+                   ST_MakeEnvelope(-11040000, 2200000, -11039990, 2200010) AS geometry
+        )""")
+        before = [con.execute(f"SELECT COUNT(*) FROM {table};").fetchone()[0] for table in (TABLE_NAME, db.PRETILED_TABLE)]
+
+        # Fails when the new table is built, after the old types and pre-tiled table were dropped
+        with pytest.raises(duckdb.Error):
+            db.create_table(con, f"(SELECT * REPLACE (error('boom') AS geometry) FROM {TABLE_NAME})")
+        assert [con.execute(f"SELECT COUNT(*) FROM {table};").fetchone()[0] for table in (TABLE_NAME, db.PRETILED_TABLE)] == before
+        assert db._is_compact(con)
+    finally:
+        con.close()
+
+# --- Pre-tiling Tests ---
+
+def test_pretiled_table_keeps_polygon_of_collection_in_one_cell(tmp_path):
+    """Test that a parcel stored as a polygon+line collection inside a single cell keeps its polygon."""
+    span = 2 * WEB_MERCATOR_HALF_WORLD / 2 ** db.PRETILE_ZOOM
+    # Center of a cell, far enough from its edges that no neighbor's buffered envelope reaches the parcel
+    cx = -WEB_MERCATOR_HALF_WORLD + (int((-11040000 + WEB_MERCATOR_HALF_WORLD) / span) + 0.5) * span
+    cy = WEB_MERCATOR_HALF_WORLD - (int((WEB_MERCATOR_HALF_WORLD - 2200000) / span) + 0.5) * span
+    collection = (
+        f"GEOMETRYCOLLECTION(POLYGON(({cx} {cy}, {cx + 10} {cy}, {cx + 10} {cy + 10}, {cx} {cy + 10}, {cx} {cy})), "
+        f"LINESTRING({cx + 10} {cy}, {cx + 20} {cy}))"
+    )
+    con = duckdb.connect(str(tmp_path / "collection.duckdb"))
+    try:
+        con.execute("INSTALL spatial;")
+        con.execute("LOAD spatial;")
+        db.create_table(con, f"""(
+            SELECT 1 AS gid, 'a' AS clave, 'H' AS uso_suelo, 'Coyoacán' AS alcaldia, '2' AS no_niveles,
+                   ST_GeomFromText('{collection}') AS geometry
+        )""")
+        pieces = con.execute(
+            f"SELECT CAST(ST_GeometryType(geometry) AS VARCHAR), ST_Area(geometry) FROM {db.PRETILED_TABLE};"
+        ).fetchall()
+        assert len(pieces) == 1
+        kind, area = pieces[0]
+        assert kind in ("POLYGON", "MULTIPOLYGON")
+        assert area == pytest.approx(100)
+    finally:
+        con.close()
+
+def test_pretiled_tiles_match_parcel_tiles():
+    """Test that tiles rendered from the pre-tiled pieces encode the same features as tiles rendered from the parcels."""
+    with TestClient(app):
+        with db_connection() as con:
+            assert db.table_exists(con, db.PRETILED_TABLE)
+            assert tiles.tile_source(con, db.PRETILE_ZOOM) == db.PRETILED_TABLE
+            # Clipping keeps only polygonal pieces, never lines or points left by edge contacts
+            kinds = con.execute(
+                f"SELECT DISTINCT CAST(ST_GeometryType(geometry) AS VARCHAR) FROM {db.PRETILED_TABLE};"
+            ).fetchall()
+            assert {kind for kind, in kinds} <= {"POLYGON", "MULTIPOLYGON"}
+            for z in (db.PRETILE_ZOOM, db.PRETILE_ZOOM + 2):
+                tile_x, tile_y = _data_center_tile(con, z)
+                parcels = con.execute(build_tile_query(z, tile_x, tile_y, TABLE_NAME)).fetchone()
+                pieces = con.execute(build_tile_query(z, tile_x, tile_y, db.PRETILED_TABLE)).fetchone()
+                assert pieces[1] == parcels[1] > 0
+
+                # Neighboring tiles of a batch share parcels cut at the cell edges; each is encoded once per tile
+                coords = [(tile_x + dx, tile_y + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+                batch = dict(
+                    ((x, y), count)
+                    for x, y, _, count in con.execute(tiles.build_batch_query(z, coords, db.PRETILED_TABLE)).fetchall()
+                )
+                for x, y in coords:
+                    expected = con.execute(build_tile_query(z, x, y, TABLE_NAME)).fetchone()[1]
+                    assert batch.get((x, y), 0) == expected
@@ -0,0 +1,64 @@
+import duckdb
+import time
+from fastapi.testclient import TestClient
+import backend.main as main
+from backend.profiling import TileProfiler, duckdb_profiling
+
+def test_duckdb_profiling_captures_operators():
+    """Test that the profiling context returns query timings and per-operator rows."""
+    con = duckdb.connect()
+    con.execute("CREATE TABLE t AS SELECT range AS a FROM range(1000);")
+    with duckdb_profiling(con) as profile:
+        con.execute("SELECT SUM(a) FROM t WHERE a > 10;").fetchone()
+    assert "latency" in profile
+    assert any(op.get("operator_cardinality") for op in profile["operators"])
+    # Profiling is switched off again afterwards
+    assert con.execute("SELECT current_setting('enable_profiling');").fetchone()[0] != "no_output"
+    con.close()
+
+def test_profiler_keeps_slowest_tiles():
+    """Test that only the N slowest profiles are kept, slowest first."""
+    profiler = TileProfiler(lambda z, x, y: {}, sample_rate=1.0, slow_ms=0, keep=2)
+    for latency in (5.0, 50.0, 1.0, 20.0):
+        profiler.observe(14, 0, 0, latency, profile={"latency": latency})
+    assert [entry["latency_ms"] for entry in profiler.slowest()] == [50.0, 20.0]
+
+def test_profiler_reprofiles_slow_tiles():
+    """Test that unsampled tiles over the threshold are re-run with profiling."""
+    profiled = []
+    profiler = TileProfiler(lambda z, x, y: profiled.append((z, x, y)) or {"latency": 0.1},
+                            sample_rate=0, slow_ms=100, keep=5)
+    with TestClient(main.app):
+        profiler.start()
+        profiler.observe(14, 1, 2, latency_ms=10)
+        profiler.observe(14, 3, 4, latency_ms=250)
+        deadline = time.monotonic() + 5
+        while not profiler.slowest() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        profiler.stop()
+    assert profiled == [(14, 3, 4)]
+    [entry] = profiler.slowest()
+    assert entry["tile"] == "14/3/4"
+    assert entry["reason"] == "slow"
+    assert entry["profile"] == {"latency": 0.1}
+
+def test_admin_slow_tiles_endpoint(monkeypatch):
+    """Test that sampled tile generations show up in the admin endpoint."""
+    monkeypatch.setattr(main.tile_profiler, "sample_rate", 1.0)
+    main.tile_profiler.clear()
+    with TestClient(main.app) as client:
+        client.get(f"/tiles/14/0/0.pbf?v=profile-{time.time()}")
+        # Without a configured token the endpoint does not exist
+        monkeypatch.setattr(main, "ADMIN_TOKEN", None)
+        assert client.get("/admin/slow-tiles").status_code == 404
+
+        monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+        assert client.get("/admin/slow-tiles").status_code == 403
+        assert client.get("/admin/slow-tiles", headers={"X-Admin-Token": "wrong"}).status_code == 403
+        response = client.get("/admin/slow-tiles", headers={"X-Admin-Token": "secret"})
+        assert response.status_code == 200
+        body = response.json()
+        assert body["enabled"] is True
+        assert body["tiles"][0]["tile"] == "14/0/0"
+        assert body["tiles"][0]["reason"] == "sampled"
+        assert "operators" in body["tiles"][0]["profile"]
@@ -0,0 +1,397 @@
+import duckdb
+import struct
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from .db import PRETILE_ZOOM, PRETILED_TABLE, TABLE_NAME, WEB_MERCATOR_HALF_WORLD, pretile_key, table_exists
+from .profiling import duckdb_profiling
+
+# --- Constants ---
+# The name of the layer in the MVT tile
+LAYER_NAME = "cadastre_layer"
+# MVT encoding parameters shared by every tile query
+MVT_EXTENT = 4096
+MVT_BUFFER = 256
+# Tiles per side of the blocks a batch is split into on the parcel table. Each
+# block is one query whose covering envelope spans at most this many tiles per
+# side, so scattered tiles never pull a city-wide envelope through ST_Simplify.
+BATCH_BLOCK_TILES = 4
+# Batch container layout (big-endian):
+#   header: magic (4s), version (H), tile count (I)
+#   per tile: z (B), x (I), y (I), length (I), followed by `length` MVT bytes
+BATCH_MAGIC = b"MVTB"
+BATCH_VERSION = 1
+_BATCH_HEADER = struct.Struct(">4sHI")
+_BATCH_ENTRY = struct.Struct(">BIII")
+
+class TileBudget(NamedTuple):
+    """Upper bounds on the encoded size and the feature count of one tile."""
+    max_bytes: int
+    max_features: int
+
+class RenderedTile(NamedTuple):
+    """An encoded tile and the reduction applied to fit its budget, if any."""
+    data: Optional[bytes]
+    reduction: Optional[str]
+
+# Per-zoom tile budgets. Dense downtown tiles at low zooms are the ones at risk.
+TILE_BUDGETS: Dict[int, TileBudget] = {
+    14: TileBudget(max_bytes=512 * 1024, max_features=8000),
+    15: TileBudget(max_bytes=512 * 1024, max_features=8000),
+    16: TileBudget(max_bytes=768 * 1024, max_features=12000),
+    17: TileBudget(max_bytes=1024 * 1024, max_features=16000),
+    18: TileBudget(max_bytes=1024 * 1024, max_features=16000),
+}
+# Reductions tried in order until an over-budget tile fits:
+# (simplification tolerance multiplier, minimum parcel area in square pixels)
+REDUCTION_STEPS = [(2, 1), (4, 4), (8, 16)]
+
+# Whether the database behind each connection (by id) has the pre-tiled table
+_pretiled: Dict[int, bool] = {}
+
+# Counters of budget enforcement, exposed through /metrics
+_budget_lock = threading.Lock()
+_budget_stats: Dict[str, object] = {
+    "over_budget": 0,
+    "reduced_to_fit": 0,
+    "still_over_budget": 0,
+    "reductions": {},
+}
+
+def get_resolution(z: int) -> float:
+    """
+    Returns the size of one pixel in meters at the given zoom level.
+    """
+    # Earth circumference in meters (Web Mercator)
+    circumference = 40075016.68
+    tile_size = 256
+    return circumference / (tile_size * (2 ** z))
+
+def get_simplification_tolerance(z: int):
+    """
+    Returns the simplification tolerance based on the zoom level.
+    """
+    # Simplification tolerance: 0.5 pixel
+    return get_resolution(z) * 0.5
+
+def tile_source(db_con: duckdb.DuckDBPyConnection, z: int) -> str:
+    """
+    Returns the table tiles at zoom z are rendered from: the pre-tiled pieces
+    from PRETILE_ZOOM down, if the database has them, otherwise the parcels.
+    """
+    if z < PRETILE_ZOOM:
+        return TABLE_NAME
+    key = id(db_con)
+    if key not in _pretiled:
+        _pretiled[key] = table_exists(db_con, PRETILED_TABLE)
+    return PRETILED_TABLE if _pretiled[key] else TABLE_NAME
+
+def build_tile_query(z: int, x, y, source: str = TABLE_NAME, tolerance_scale: float = 1, min_area: float = 0) -> str:
+    """
+    Builds the MVT generation query for one tile.
+    `x` and `y` are either integer literals or SQL parameter placeholders ($1, $2).
+    `tolerance_scale` and `min_area` (square meters) are only used when
+    reducing an over-budget tile.
+    On the pre-tiled table, features are looked up by the key of the tile's
+    ancestor at PRETILE_ZOOM instead of through the RTREE index.
+    """
+    simplification_tolerance = get_simplification_tolerance(z) * tolerance_scale
+    if source == PRETILED_TABLE:
+        if z < PRETILE_ZOOM:
+            raise ValueError(f"The pre-tiled table only serves zoom {PRETILE_ZOOM} and deeper, not {z}.")
+        shift = z - PRETILE_ZOOM
+        tile_key = f"((CAST({x} AS BIGINT) >> {shift}) << {PRETILE_ZOOM}) | (CAST({y} AS BIGINT) >> {shift})"
+        tile_filter = f"t.tile_key = {tile_key} AND ST_Intersects(t.geometry, ST_TileEnvelope({z}, {x}, {y}))"
+        # Pieces carry the area of the whole parcel they were cut from
+        area = "t.area"
+    else:
+        tile_filter = f"ST_Intersects(t.geometry, ST_TileEnvelope({z}, {x}, {y}))"
+        area = "ST_Area(t.geometry)"
+    # We removed the area filter to ensure full coverage; it only comes back for over-budget tiles
+    area_filter = f"AND {area} >= {min_area}" if min_area else ""
+    return f"""
+        WITH
+        bounds_box AS (
+            -- 1. Use Web Mercator tile bounds (EPSG:3857)
+            -- Compute a Box2D for MVT encoding; keep the intersects predicate inline to hit RTREE.
+            SELECT
+                ST_Extent(ST_TileEnvelope({z}, {x}, {y})) AS box
+        ),
+        features AS (
+            -- 2. Select features that intersect with the tile bounds
+            SELECT
+                t.gid,
+                t.clave,
+                -- ENUM columns are encoded as their string values
+                CAST(t.uso_suelo AS VARCHAR) AS uso_suelo,
+                CAST(t.alcaldia AS VARCHAR) AS alcaldia,
+                t.no_niveles, -- Normalized to a non-null INTEGER at ingest
+                -- 3. Use the full ST_AsMVTGeom signature for robustness
+                ST_AsMVTGeom(
+                    ST_Simplify(t.geometry, {simplification_tolerance}),
+                    (SELECT box FROM bounds_box),
+                    {MVT_EXTENT}, -- Extent
+                    {MVT_BUFFER},  -- Buffer
+                    true  -- Clip Geom
+                ) AS mvt_geom
+            FROM {source} t
+            WHERE {tile_filter}
+            {area_filter}
+        )
+        -- 5. Aggregate the clipped geometries into a single MVT layer
+        SELECT
+            CASE
+                WHEN COUNT(*) = 0 THEN NULL
+                ELSE ST_AsMVT(sub, '{LAYER_NAME}')
+            END AS tile,
+            COUNT(*) AS feature_count
+        FROM (
+            SELECT gid, clave, uso_suelo, alcaldia, no_niveles, mvt_geom FROM features
+            WHERE mvt_geom IS NOT NULL
+        ) AS sub;
+    """
+
+def tile_in_range(z: int, x: int, y: int) -> bool:
+    """Returns True if x and y address one of the 2**z by 2**z tiles of zoom z."""
+    return 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+def tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """Returns the (xmin, ymin, xmax, ymax) Web Mercator bounds of an XYZ tile."""
+    tile_span = 2 * WEB_MERCATOR_HALF_WORLD / (2 ** z)
+    xmin = -WEB_MERCATOR_HALF_WORLD + x * tile_span
+    ymax = WEB_MERCATOR_HALF_WORLD - y * tile_span
+    return xmin, ymax - tile_span, xmin + tile_span, ymax
+
+def build_batch_query(z: int, coords: List[Tuple[int, int]], source: str = TABLE_NAME) -> str:
+    """
+    Builds one query that encodes every requested tile of a single zoom level.
+    Candidates are selected once with the envelope covering all the tiles (a
+    literal, so the RTREE index is used), simplified once, and then clipped
+    and aggregated per tile. On the pre-tiled table, candidates are the pieces
+    of the ancestor cells of the tiles, and each tile only joins the pieces of
+    its own cell so a parcel cut in two is not encoded twice.
+    """
+    simplification_tolerance = get_simplification_tolerance(z)
+    if source == PRETILED_TABLE:
+        if z < PRETILE_ZOOM:
+            raise ValueError(f"The pre-tiled table only serves zoom {PRETILE_ZOOM} and deeper, not {z}.")
+        shift = z - PRETILE_ZOOM
+        keyed = [(int(x), int(y), pretile_key(int(x) >> shift, int(y) >> shift)) for x, y in coords]
+        cell_keys = ", ".join(str(key) for key in sorted({key for _, _, key in keyed}))
+        candidate_key = "t.tile_key,"
+        candidate_filter = f"t.tile_key IN ({cell_keys})"
+        tile_join = "c.tile_key = tiles.tile_key AND ST_Intersects(c.geometry, tiles.env)"
+    else:
+        keyed = [(int(x), int(y), 0) for x, y in coords]
+        candidate_key = ""
+        xs = [x for x, _ in coords]
+        ys = [y for _, y in coords]
+        cover_xmin, _, _, cover_ymax = tile_bounds(z, min(xs), min(ys))
+        _, cover_ymin, cover_xmax, _ = tile_bounds(z, max(xs), max(ys))
+        candidate_filter = f"ST_Intersects(t.geometry, ST_MakeEnvelope({cover_xmin}, {cover_ymin}, {cover_xmax}, {cover_ymax}))"
+        tile_join = "ST_Intersects(c.geometry, tiles.env)"
+    requested = ", ".join(f"({x}, {y}, {key})" for x, y, key in keyed)
+    return f"""
+        WITH
+        requested(x, y, tile_key) AS (
+            VALUES {requested}
+        ),
+        tiles AS (
+            -- 1. Envelope and Box2D of every requested tile
+            SELECT
+                x,
+                y,
+                tile_key,
+                ST_TileEnvelope({z}, x, y) AS env,
+                ST_Extent(ST_TileEnvelope({z}, x, y)) AS box
+            FROM requested
+        ),
+        candidates AS (
+            -- 2. One RTREE probe for the range covering all requested tiles (or one key lookup per cell)
+            SELECT
+                {candidate_key}
+                t.gid,
+                t.clave,
+                -- ENUM columns are encoded as their string values
+                CAST(t.uso_suelo AS VARCHAR) AS uso_suelo,
+                CAST(t.alcaldia AS VARCHAR) AS alcaldia,
+                t.no_niveles, -- Normalized to a non-null INTEGER at ingest
+                t.geometry,
+                ST_Simplify(t.geometry, {simplification_tolerance}) AS simplified
+            FROM {source} t
+            WHERE {candidate_filter}
+        ),
+        features AS (
+            -- 3. Clip each candidate against every tile it touches
+            SELECT
+                tiles.x,
+                tiles.y,
+                c.gid,
+                c.clave,
+                c.uso_suelo,
+                c.alcaldia,
+                c.no_niveles,
+                ST_AsMVTGeom(c.simplified, tiles.box, {MVT_EXTENT}, {MVT_BUFFER}, true) AS mvt_geom
+            FROM candidates c
+            JOIN tiles ON {tile_join}
+        )
+        -- 4. Aggregate one MVT layer per tile
+        SELECT
+            x,
+            y,
+            ST_AsMVT({{
+                'gid': gid,
+                'clave': clave,
+                'uso_suelo': uso_suelo,
+                'alcaldia': alcaldia,
+                'no_niveles': no_niveles,
+                'mvt_geom': mvt_geom
+            }}, '{LAYER_NAME}') AS tile,
+            COUNT(*) AS feature_count
+        FROM features
+        WHERE mvt_geom IS NOT NULL
+        GROUP BY x, y;
+    """
+
+def fetch_tiles(db_con: duckdb.DuckDBPyConnection, z: int, coords: List[Tuple[int, int]], source: Optional[str] = None) -> Dict[Tuple[int, int], RenderedTile]:
+    """
+    Generates several tiles of one zoom level with as few spatial queries as possible.
+    On the pre-tiled table, one query reads the cells of all the tiles. On the
+    parcel table, tiles are grouped into BATCH_BLOCK_TILES blocks with one query
+    per block, and a tile alone in its block runs the single-tile query.
+    Tiles over their budget are re-rendered individually with reductions.
+    Returns a mapping of (x, y) to rendered tiles; empty tiles have no data.
+    `source` defaults to tile_source() for the zoom.
+    """
+    tiles = {coord: RenderedTile(None, None) for coord in coords}
+    if not coords:
+        return tiles
+    source = source or tile_source(db_con, z)
+    if source == PRETILED_TABLE:
+        groups = [coords]
+    else:
+        blocks: Dict[Tuple[int, int], List[Tuple[int, int]]] = {}
+        for x, y in coords:
+            blocks.setdefault((x // BATCH_BLOCK_TILES, y // BATCH_BLOCK_TILES), []).append((x, y))
+        groups = list(blocks.values())
+
+    for group in groups:
+        if len(group) == 1:
+            x, y = group[0]
+            tiles[(x, y)] = render_tile(db_con, z, x, y, source)
+            continue
+        for x, y, tile, feature_count in db_con.execute(build_batch_query(z, group, source)).fetchall():
+            tiles[(x, y)] = _enforce_budget(db_con, z, x, y, source, tile or None, feature_count)
+    return tiles
+
+def encode_tile_batch(tiles: Iterable[Tuple[int, int, int, Optional[bytes]]]) -> bytes:
+    """
+    Packs (z, x, y, data) tuples into the length-prefixed batch container.
+    Empty tiles are written with a length of 0.
+    """
+    entries = list(tiles)
+    parts = [_BATCH_HEADER.pack(BATCH_MAGIC, BATCH_VERSION, len(entries))]
+    for z, x, y, data in entries:
+        data = data or b""
+        parts.append(_BATCH_ENTRY.pack(z, x, y, len(data)))
+        parts.append(data)
+    return b"".join(parts)
+
+def decode_tile_batch(payload: bytes) -> List[Tuple[int, int, int, bytes]]:
+    """Unpacks a batch container into a list of (z, x, y, data) tuples."""
+    magic, version, count = _BATCH_HEADER.unpack_from(payload, 0)
+    if magic != BATCH_MAGIC or version != BATCH_VERSION:
+        raise ValueError(f"Unsupported tile batch container (magic={magic!r}, version={version}).")
+    offset = _BATCH_HEADER.size
+    tiles = []
+    for _ in range(count):
+        z, x, y, length = _BATCH_ENTRY.unpack_from(payload, offset)
+        offset += _BATCH_ENTRY.size
+        tiles.append((z, x, y, bytes(payload[offset:offset + length])))
+        offset += length
+    return tiles
+
+def _run_tile_query(db_con: duckdb.DuckDBPyConnection, z: int, x: int, y: int, source: str) -> Tuple[Optional[bytes], int]:
+    """
+    Runs the tile query for z/x/y and returns the MVT bytes (None if the tile
+    has no features) and the number of features encoded.
+    The query is run as literal SQL: DuckDB plans a prepared statement again
+    for each set of bound values, so preparing saves no planning time (see
+    time_prepared_vs_literal in test_duckdb.py).
+    """
+    result = db_con.execute(build_tile_query(z, int(x), int(y), source)).fetchone()
+
+    if not result or not result[0]:
+        return None, 0
+    return result[0], result[1]
+
+def fetch_tile(db_con: duckdb.DuckDBPyConnection, z: int, x: int, y: int, source: Optional[str] = None) -> Optional[bytes]:
+    """
+    Runs the tile query for z/x/y on a borrowed connection and returns the MVT
+    bytes, or None if the tile has no features. No budget is applied.
+    `source` defaults to tile_source() for the zoom.
+    """
+    return _run_tile_query(db_con, z, x, y, source or tile_source(db_con, z))[0]
+
+def render_tile(db_con: duckdb.DuckDBPyConnection, z: int, x: int, y: int, source: Optional[str] = None,
+                profile: Optional[Dict[str, object]] = None) -> RenderedTile:
+    """
+    Renders z/x/y within its zoom's budget, reducing detail if necessary.
+    `source` defaults to tile_source() for the zoom. If `profile` is given, it is
+    filled with the DuckDB profile of the first tile query; reduction re-renders
+    are not profiled.
+    """
+    source = source or tile_source(db_con, z)
+    if profile is None:
+        tile, feature_count = _run_tile_query(db_con, z, x, y, source)
+    else:
+        with duckdb_profiling(db_con) as query_profile:
+            tile, feature_count = _run_tile_query(db_con, z, x, y, source)
+        profile.update(query_profile)
+    return _enforce_budget(db_con, z, x, y, source, tile, feature_count)
+
+def _within_budget(z: int, tile: Optional[bytes], feature_count: int) -> bool:
+    budget = TILE_BUDGETS.get(z)
+    if budget is None or tile is None:
+        return True
+    return len(tile) <= budget.max_bytes and feature_count <= budget.max_features
+
+def _enforce_budget(db_con: duckdb.DuckDBPyConnection, z: int, x: int, y: int, source: str,
+                    tile: Optional[bytes], feature_count: int) -> RenderedTile:
+    """
+    Returns the tile unchanged if it fits its budget. Otherwise re-renders it
+    with the REDUCTION_STEPS in order (coarser simplification and dropping
+    parcels below a pixel area) until it fits; if none does, the most reduced
+    tile is returned.
+    """
+    if _within_budget(z, tile, feature_count):
+        return RenderedTile(tile, None)
+
+    _count_budget("over_budget")
+    pixel_area = get_resolution(z) ** 2
+    for tolerance_scale, min_area_px in REDUCTION_STEPS:
+        reduction = f"tolerance={tolerance_scale}x;min_area={min_area_px}px"
+        query = build_tile_query(z, int(x), int(y), source, tolerance_scale, min_area_px * pixel_area)
+        tile, feature_count = db_con.execute(query).fetchone()
+        if _within_budget(z, tile or None, feature_count):
+            _count_budget("reduced_to_fit", reduction)
+            return RenderedTile(tile or None, reduction)
+
+    print(f"Tile z={z}, x={x}, y={y} is still over budget after {reduction}.")
+    _count_budget("still_over_budget", reduction)
+    return RenderedTile(tile or None, reduction)
+
+def _count_budget(outcome: str, reduction: Optional[str] = None):
+    with _budget_lock:
+        _budget_stats[outcome] += 1
+        if reduction is not None:
+            reductions = _budget_stats["reductions"]
+            reductions[reduction] = reductions.get(reduction, 0) + 1
+
+def tile_budget_stats() -> Dict[str, object]:
+    """Returns how many tiles exceeded their budget and which reductions were applied."""
+    with _budget_lock:
+        return {**_budget_stats, "reductions": dict(_budget_stats["reductions"])}
+
+def reset_connection_state():
+    """Forgets what was learned about each connection. Call when the connection pool is closed."""
+    _pretiled.clear()
@@ -0,0 +1,162 @@
+import json
+import os
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Iterable, List, Optional, Set, Tuple
+from .db import BACKGROUND_MIN_IDLE, idle_connections
+
+# --- Constants ---
+# File where the most requested tiles are persisted between runs
+HOT_LIST_PATH = os.getenv(
+    "TILE_HOT_LIST_PATH",
+    os.path.join(os.path.dirname(__file__), "..", "data", "hot_tiles.json"),
+)
+# Number of hot tiles saved at shutdown and warmed at the next startup
+HOT_LIST_TOP_K = int(os.getenv("TILE_WARM_TOP_K", "500"))
+# Background threads rendering prefetched tiles; kept below the pool size
+PREFETCH_WORKERS = 1
+# Maximum number of prefetch tasks waiting to run; extra candidates are dropped
+PREFETCH_MAX_PENDING = 256
+# Hot-list tiles queued at once at startup; the rest are fed in as they finish,
+# leaving the other half of the queue to prefetches of live requests
+HOT_LIST_MAX_PENDING = PREFETCH_MAX_PENDING // 2
+# Distinct tiles counted per top-K entry before the rarest counts are dropped
+COUNTS_PER_HOT_TILE = 10
+
+Tile = Tuple[int, int, int]
+
+def neighbor_tiles(z: int, x: int, y: int, max_zoom: int) -> List[Tile]:
+    """
+    Returns the tiles most likely to be requested after z/x/y: the eight
+    neighbors at the same zoom and the four children one zoom deeper.
+    """
+    n = 2 ** z
+    tiles = [
+        (z, x + dx, y + dy)
+        for dx in (-1, 0, 1)
+        for dy in (-1, 0, 1)
+        if (dx or dy) and 0 <= x + dx < n and 0 <= y + dy < n
+    ]
+    if z < max_zoom:
+        tiles.extend((z + 1, 2 * x + dx, 2 * y + dy) for dx in (0, 1) for dy in (0, 1))
+    return tiles
+
+class TileWarmer:
+    """
+    Records tile access frequency and renders likely-next tiles in the background
+    so they are already cached when requested.
+    """
+
+    def __init__(self, render: Callable[[int, int, int], object], min_zoom: int, max_zoom: int,
+                 hot_list_path: str = HOT_LIST_PATH, top_k: int = HOT_LIST_TOP_K):
+        self._render = render
+        self._min_zoom = min_zoom
+        self._max_zoom = max_zoom
+        self._hot_list_path = hot_list_path
+        self._top_k = top_k
+        self._counts: Counter = Counter()
+        self._pending: Set[Tile] = set()
+        # Hot-list tiles from the previous run still waiting to be queued
+        self._backlog: Deque[Tile] = deque()
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def start(self):
+        """Starts the background workers and warms the hot list of the previous run."""
+        self._executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="tile-warmer")
+        hot_tiles = self._load_hot_list()
+        if hot_tiles:
+            print(f"Warming {len(hot_tiles)} hot tiles from {self._hot_list_path}...")
+        with self._lock:
+            self._backlog.extend(hot_tiles)
+        self._feed_backlog()
+
+    def stop(self):
+        """Persists the hot list and stops the workers, dropping queued prefetches."""
+        self._save_hot_list()
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            self._pending.clear()
+            self._backlog.clear()
+
+    def record(self, z: int, x: int, y: int):
+        """
+        Counts one live request for z/x/y. Past COUNTS_PER_HOT_TILE times top_k
+        distinct tiles, only the most requested half of that are kept.
+        """
+        with self._lock:
+            self._counts[(z, x, y)] += 1
+            limit = COUNTS_PER_HOT_TILE * self._top_k
+            if len(self._counts) > limit:
+                self._counts = Counter(dict(self._counts.most_common(limit // 2)))
+
+    def prefetch_around(self, z: int, x: int, y: int):
+        """Queues the neighbors and children of a requested tile."""
+        self.prefetch(neighbor_tiles(z, x, y, self._max_zoom))
+
+    def prefetch(self, tiles: Iterable[Tile]):
+        """Queues tiles for background rendering, skipping duplicates and overflow."""
+        for tile in tiles:
+            if not (self._min_zoom <= tile[0] <= self._max_zoom):
+                continue
+            with self._lock:
+                executor = self._executor
+                if executor is None or tile in self._pending or len(self._pending) >= PREFETCH_MAX_PENDING:
+                    continue
+                self._pending.add(tile)
+            try:
+                executor.submit(self._warm, tile)
+            except RuntimeError:
+                # The executor was shut down between the check and the submit
+                with self._lock:
+                    self._pending.discard(tile)
+
+    def hot_tiles(self, k: Optional[int] = None) -> List[Tile]:
+        """Returns the k most requested tiles, most frequent first."""
+        with self._lock:
+            return [tile for tile, _ in self._counts.most_common(k or self._top_k)]
+
+    def _warm(self, tile: Tile):
+        try:
+            # Never compete with live requests for the last free connections
+            if idle_connections() >= BACKGROUND_MIN_IDLE:
+                self._render(*tile)
+        except Exception as e:
+            print(f"Error prefetching tile {tile}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(tile)
+            self._feed_backlog()
+
+    def _feed_backlog(self):
+        """Queues hot-list tiles while fewer than HOT_LIST_MAX_PENDING tasks are waiting."""
+        with self._lock:
+            room = HOT_LIST_MAX_PENDING - len(self._pending)
+            tiles = [self._backlog.popleft() for _ in range(min(room, len(self._backlog)))]
+        self.prefetch(tiles)
+
+    def _load_hot_list(self) -> List[Tile]:
+        if not os.path.exists(self._hot_list_path):
+            return []
+        try:
+            with open(self._hot_list_path) as f:
+                return [tuple(int(v) for v in tile) for tile in json.load(f)][: self._top_k]
+        except (OSError, ValueError, TypeError) as e:
+            print(f"Ignoring unreadable hot tile list {self._hot_list_path}: {e}")
+            return []
+
+    def _save_hot_list(self):
+        hot_tiles = self.hot_tiles()
+        if not hot_tiles:
+            return
+        # Each worker process writes its own temporary file before the atomic rename
+        tmp_path = f"{self._hot_list_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump([list(tile) for tile in hot_tiles], f)
+            os.replace(tmp_path, self._hot_list_path)
+        except OSError as e:
+            print(f"Could not save hot tile list to {self._hot_list_path}: {e}")
@@ -0,0 +1,90 @@
+import argparse
+import os
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+
+WEB_MERCATOR_HALF_WORLD = 20037508.342789244
+# Mexico City center in EPSG:3857
+CENTER_X, CENTER_Y = -11035000, 2205000
+
+def mercator_to_tile(x: float, y: float, z: int):
+    n = 2 ** z
+    tile_x = int((x + WEB_MERCATOR_HALF_WORLD) / (2 * WEB_MERCATOR_HALF_WORLD) * n)
+    tile_y = int((WEB_MERCATOR_HALF_WORLD - y) / (2 * WEB_MERCATOR_HALF_WORLD) * n)
+    return tile_x, tile_y
+
+def sample_tile_urls(count: int, zoom: int, spread: int):
+    """Returns tile URLs scattered around the city center."""
+    rng = random.Random(42)
+    center_x, center_y = mercator_to_tile(CENTER_X, CENTER_Y, zoom)
+    return [
+        f"/tiles/{zoom}/{center_x + rng.randint(-spread, spread)}/{center_y + rng.randint(-spread, spread)}.pbf"
+        for _ in range(count)
+    ]
+
+def start_server(workers: int, port: int) -> subprocess.Popen:
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), TILE_PREFETCH="0")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(port), "--workers", str(workers)],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health").json()["status"] == "ok":
+                return server
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError(f"Server with {workers} workers did not become healthy.")
+
+def run_load(port: int, urls, concurrency: int, duration: float) -> float:
+    """Requests the URLs round-robin from `concurrency` threads and returns requests per second."""
+    deadline = time.monotonic() + duration
+
+    def client_loop(offset: int) -> int:
+        done = 0
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}") as client:
+            while time.monotonic() < deadline:
+                client.get(urls[(offset + done) % len(urls)])
+                done += 1
+        return done
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        total = sum(pool.map(client_loop, range(0, concurrency * 97, 97)))
+    return total / (time.monotonic() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure tile throughput with 1..N uvicorn workers.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--zoom", type=int, default=15)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    urls = sample_tile_urls(512, args.zoom, spread=20)
+    baseline = None
+    print(f"{'workers':>8} {'req/s':>10} {'speedup':>8}")
+    for workers in args.workers:
+        server = start_server(workers, args.port)
+        try:
+            # Warm-up pass so every worker and the shared cache see the tile set
+            run_load(args.port, urls, args.concurrency, min(5.0, args.duration))
+            rps = run_load(args.port, urls, args.concurrency, args.duration)
+        finally:
+            server.terminate()
+            server.wait()
+        baseline = baseline or rps
+        print(f"{workers:>8} {rps:>10.1f} {rps / baseline:>7.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import argparse
+import math
+import duckdb
+from backend.archive import ARCHIVE_PATH, write_archive
+from backend.db import DB_PATH, TABLE_NAME, database_fingerprint
+from backend.tiles import WEB_MERCATOR_HALF_WORLD, fetch_tiles
+
+# Tiles per side of each block rendered with one batch query
+BLOCK_SIZE = 8
+
+def tile_range(xmin: float, ymin: float, xmax: float, ymax: float, z: int):
+    """Returns the inclusive (x0, y0, x1, y1) XYZ tile range covering a Web Mercator extent."""
+    n = 2 ** z
+    world = 2 * WEB_MERCATOR_HALF_WORLD
+    x0 = int((xmin + WEB_MERCATOR_HALF_WORLD) / world * n)
+    x1 = min(int((xmax + WEB_MERCATOR_HALF_WORLD) / world * n), n - 1)
+    y0 = int((WEB_MERCATOR_HALF_WORLD - ymax) / world * n)
+    y1 = min(int((WEB_MERCATOR_HALF_WORLD - ymin) / world * n), n - 1)
+    return x0, y0, x1, y1
+
+def render_tiles(conn: duckdb.DuckDBPyConnection, min_zoom: int, max_zoom: int):
+    """Yields (z, x, y, data) for every tile covering the data extent."""
+    xmin, ymin, xmax, ymax = conn.execute(
+        f"SELECT ST_XMin(ext), ST_YMin(ext), ST_XMax(ext), ST_YMax(ext) "
+        f"FROM (SELECT ST_Extent_Agg(geometry) AS ext FROM {TABLE_NAME});"
+    ).fetchone()
+    for z in range(min_zoom, max_zoom + 1):
+        x0, y0, x1, y1 = tile_range(xmin, ymin, xmax, ymax, z)
+        blocks = math.ceil((x1 - x0 + 1) / BLOCK_SIZE) * math.ceil((y1 - y0 + 1) / BLOCK_SIZE)
+        print(f"z={z}: tiles x {x0}-{x1}, y {y0}-{y1} in {blocks} blocks")
+        for bx in range(x0, x1 + 1, BLOCK_SIZE):
+            for by in range(y0, y1 + 1, BLOCK_SIZE):
+                coords = [
+                    (x, y)
+                    for x in range(bx, min(bx + BLOCK_SIZE, x1 + 1))
+                    for y in range(by, min(by + BLOCK_SIZE, y1 + 1))
+                ]
+                for (x, y), tile in fetch_tiles(conn, z, coords).items():
+                    yield z, x, y, tile.data
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute vector tiles into a memory-mappable archive.")
+    parser.add_argument("--min-zoom", type=int, default=14)
+    parser.add_argument("--max-zoom", type=int, default=16)
+    parser.add_argument("--output", default=ARCHIVE_PATH)
+    args = parser.parse_args()
+
+    # The server only serves the archive while it serves this same database file
+    data_version = database_fingerprint()
+    print(f"Building tile archive {args.output} from {DB_PATH} (data version {data_version}, z{args.min_zoom}-z{args.max_zoom})...")
+    conn = duckdb.connect(database=DB_PATH, read_only=True)
+    conn.execute("INSTALL spatial;")
+    conn.execute("LOAD spatial;")
+    tiles = render_tiles(conn, args.min_zoom, args.max_zoom)
+    count = write_archive(args.output, tiles, args.min_zoom, args.max_zoom, data_version)
+    conn.close()
+    print(f"Wrote {count} non-empty tiles to {args.output}.")
+
+if __name__ == "__main__":
+    main()
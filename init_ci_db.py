@@ -1,5 +1,6 @@
 import duckdb
 import os
+from backend.db import create_table
 
 # Paths matching backend/db.py
 DATA_DIR = "data"
@@ -16,8 +17,8 @@ con = duckdb.connect(db_path)
 con.execute("INSTALL spatial;")
 con.execute("LOAD spatial;")
 
-con.execute(f"CREATE OR REPLACE TABLE mexico_city AS SELECT * FROM read_parquet('{parquet_path}');")
-con.execute("CREATE INDEX IF NOT EXISTS idx_geometry ON mexico_city USING RTREE (geometry);")
+# Same compact schema and index as backend/db.py
+create_table(con, f"read_parquet('{parquet_path}')")
 
 print("Database initialized successfully.")
 con.close()
@@ -10,6 +10,9 @@ if [ ! -f "$DB_FILE" ]; then
     exit 1
 fi
 
+echo "Migrating '$DB_FILE' to the current schema..."
+python -m backend.db
+
 echo "Uploading '$DB_FILE' to '$GCS_PATH'..."
 gcloud storage cp "$DB_FILE" "$GCS_PATH"
 
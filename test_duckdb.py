@@ -2,6 +2,8 @@ import duckdb
 import math
 import os
 import time
+from backend.db import PRETILE_ZOOM, PRETILED_TABLE, create_table
+from backend.tiles import build_tile_query
 
 # Define the path to the GeoParquet file
 GEOPARQUET_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "data", "mexico_city.cleaned.3857.geoparquet"))
@@ -9,6 +11,7 @@ TABLE_NAME = "mexico_city"
 SAMPLE_ZOOMS = [14, 16, 18]
 SAMPLE_TILES = 3
 RANDOM_SEED = 0.42
+PREPARED_REPEATS = 50
 LAYER_NAME = "cadastre_layer"
 
 WEB_MERCATOR_HALF_WORLD = 20037508.342789244
@@ -226,6 +229,54 @@ def breakdown_tile_query(conn: duckdb.DuckDBPyConnection, z: int, x: int, y: int
 
     conn.execute(f"DROP TABLE {temp_table_name};")
 
+def time_prepared_vs_literal(conn: duckdb.DuckDBPyConnection, z: int, x: int, y: int):
+    """
+    Compares the per-tile cost of the literal f-string query the server runs
+    against the same query as a prepared statement with bound x/y. DuckDB plans
+    the prepared statement again for each set of values, so the two are expected
+    to match; a gap here would be planner overhead worth preparing away.
+    """
+    print(f"\n--- PREPARED vs LITERAL z={z} x={x} y={y} ({PREPARED_REPEATS} runs) ---")
+
+    literal_query = build_tile_query(z, x, y, TABLE_NAME)
+    conn.execute(literal_query).fetchone()
+    start = time.perf_counter()
+    for _ in range(PREPARED_REPEATS):
+        conn.execute(literal_query).fetchone()
+    literal_ms = (time.perf_counter() - start) * 1000 / PREPARED_REPEATS
+
+    conn.execute(f"PREPARE bench_tile AS {build_tile_query(z, '$1', '$2', TABLE_NAME)}")
+    plan = conn.execute(f"EXPLAIN EXECUTE bench_tile({x}, {y})").fetchall()
+    uses_rtree = any("RTREE_INDEX_SCAN" in str(row[-1]) for row in plan)
+    conn.execute(f"EXECUTE bench_tile({x}, {y})").fetchone()
+    start = time.perf_counter()
+    for _ in range(PREPARED_REPEATS):
+        conn.execute(f"EXECUTE bench_tile({x}, {y})").fetchone()
+    prepared_ms = (time.perf_counter() - start) * 1000 / PREPARED_REPEATS
+    conn.execute("DEALLOCATE bench_tile;")
+
+    print(f"literal: {literal_ms:.3f} ms/tile")
+    print(f"prepared: {prepared_ms:.3f} ms/tile (uses RTREE: {uses_rtree})")
+    print(f"planner overhead: {literal_ms - prepared_ms:.3f} ms/tile")
+
+def time_pretiled_vs_rtree(conn: duckdb.DuckDBPyConnection, z: int, x: int, y: int):
+    """
+    Compares rendering a tile from the parcels (RTREE probe, clip of whole
+    parcels) against the pieces pre-cut along the z14 grid (key lookup, clip
+    of small pieces).
+    """
+    if z < PRETILE_ZOOM:
+        return
+    print(f"\n--- PRE-TILED vs RTREE z={z} x={x} y={y} ({PREPARED_REPEATS} runs) ---")
+    for source in (TABLE_NAME, PRETILED_TABLE):
+        query = build_tile_query(z, x, y, source)
+        feature_count = conn.execute(query).fetchone()[1]
+        start = time.perf_counter()
+        for _ in range(PREPARED_REPEATS):
+            conn.execute(query).fetchone()
+        elapsed_ms = (time.perf_counter() - start) * 1000 / PREPARED_REPEATS
+        print(f"{source}: {elapsed_ms:.3f} ms/tile ({feature_count} features)")
+
 print(f"Testing DuckDB with GeoParquet file: {GEOPARQUET_PATH}")
 
 try:
@@ -239,8 +290,8 @@ try:
         print("Spatial extension loaded.")
 
         print(f"\nLoading data into table '{TABLE_NAME}'...")
-        conn.execute(f"CREATE TABLE {TABLE_NAME} AS SELECT * FROM read_parquet('{GEOPARQUET_PATH}');")
-        conn.execute(f"CREATE INDEX idx_geometry ON {TABLE_NAME} USING RTREE (geometry);")
+        # Same compact schema and index as the server
+        create_table(conn, f"read_parquet('{GEOPARQUET_PATH}')")
 
         # Test 1: Count features in the table
         print(f"\nAttempting to count features from: {TABLE_NAME}")
@@ -280,6 +331,8 @@ try:
                     breakdown_tile_query(conn, zoom, tile_x, tile_y, use_simplify=False)
                     time_tile_query(conn, zoom, tile_x, tile_y, use_simplify=True)
                     time_tile_query(conn, zoom, tile_x, tile_y, use_simplify=False)
+                    time_prepared_vs_literal(conn, zoom, tile_x, tile_y)
+                    time_pretiled_vs_rtree(conn, zoom, tile_x, tile_y)
         else:
             print("\nWARNING: Could not find sample geometries to derive tile coordinates.")
 